@@ -0,0 +1,398 @@
+# emotion_module.py
+# Facial emotion recognition for the chat page: a cheap face detector (Haar by
+# default), face-box tracking across frames so the full-frame search only runs
+# now and then, and FER classification of the tracked face only. Recognition
+# runs in a pool of worker processes, each with its own models.
+
+import os
+import sys
+import time
+import threading
+import cv2
+import numpy as np
+from fer import FER
+from pool_module import BoundedProcessPool, PoolBusyError, worker_resource
+
+# ---------------- SETTINGS ----------------
+DETECTOR_MODE = "haar"      # "haar" (default), "dnn" (OpenCV SSD, needs the model files) or "mtcnn"
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+DNN_PROTO = os.path.join(MODEL_DIR, "deploy.prototxt")
+DNN_WEIGHTS = os.path.join(MODEL_DIR, "res10_300x300_ssd_iter_140000.caffemodel")
+DNN_CONFIDENCE = 0.5
+
+HAAR_MIN_FACE = 48          # pixels; smaller detections are ignored
+REDETECT_EVERY = 10         # frames between full-frame detections while a face is tracked
+TRACK_PADDING = 0.5         # fraction of the face size searched around the last box
+CROP_MARGIN = 0.5           # context kept around the face for the classifier
+
+EMOTION_WORKERS = 2         # recognizer processes; 0 = recognise in the calling thread
+EMOTION_QUEUE_MAX = 8       # frames queued or running before new ones are turned away
+EMOTION_TIMEOUT = 3.0       # seconds a caller waits for its result
+FALLBACK_EMOTION = "neutral"  # answer when the pool is saturated or too slow
+
+EMOTION_HALF_LIFE = 5.0         # seconds for an observed emotion's weight to halve
+EMOTION_STABLE_SHARE = 0.5      # share of the decayed scores the leading emotion needs to count as stable
+EMOTION_MIN_INTERVAL_MS = 500   # polling interval while the emotion is changing
+EMOTION_MAX_INTERVAL_MS = 4000  # polling interval once it has been stable for a while
+EMOTION_INTERVAL_GROWTH = 1.5   # interval multiplier per frame that confirms a stable emotion
+EMOTION_IDLE_FRAMES = 3         # frames without a face before polling backs off
+# ------------------------------------------
+
+
+# ---------------- Face Detectors ----------------
+class HaarFaceDetector:
+    """
+    OpenCV frontal-face Haar cascade: a few milliseconds per frame on one core.
+    """
+
+    def __init__(self, min_face=HAAR_MIN_FACE):
+        self.min_face = min_face
+        self.cascade = cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, "haarcascade_frontalface_default.xml"))
+
+    def detect(self, bgr):
+        gray = cv2.equalizeHist(cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY))
+        faces = self.cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5,
+                                              minSize=(self.min_face, self.min_face))
+        return [tuple(int(v) for v in f) for f in faces]
+
+
+class DnnFaceDetector:
+    """
+    OpenCV DNN ResNet-10 SSD face detector (Caffe model files in MODEL_DIR).
+    More robust to pose and lighting than Haar, still far cheaper than MTCNN.
+    """
+
+    def __init__(self, proto=DNN_PROTO, weights=DNN_WEIGHTS, confidence=DNN_CONFIDENCE):
+        self.net = cv2.dnn.readNetFromCaffe(proto, weights)
+        self.confidence = confidence
+
+    def detect(self, bgr):
+        h, w = bgr.shape[:2]
+        blob = cv2.dnn.blobFromImage(cv2.resize(bgr, (300, 300)), 1.0, (300, 300), (104.0, 177.0, 123.0))
+        self.net.setInput(blob)
+        detections = self.net.forward()[0, 0]
+        faces = []
+        for det in detections[detections[:, 2] >= self.confidence]:
+            x1, y1, x2, y2 = (det[3:7] * [w, h, w, h]).astype(int)
+            x1, y1 = max(x1, 0), max(y1, 0)
+            if x2 > x1 and y2 > y1:
+                faces.append((int(x1), int(y1), int(x2 - x1), int(y2 - y1)))
+        return faces
+
+
+class MtcnnFaceDetector:
+    """
+    The MTCNN cascade FER ships with (the previous behaviour): most accurate,
+    by far the most expensive.
+    """
+
+    def __init__(self):
+        self.fer = FER(mtcnn=True)
+
+    def detect(self, bgr):
+        return [tuple(int(v) for v in f) for f in self.fer.find_faces(bgr, bgr=True)]
+
+
+def make_detector(mode=DETECTOR_MODE):
+    if mode == "dnn":
+        if os.path.exists(DNN_PROTO) and os.path.exists(DNN_WEIGHTS):
+            return DnnFaceDetector()
+        print(f"DNN face model not found in '{MODEL_DIR}', using the Haar detector.")
+        return HaarFaceDetector()
+    if mode == "mtcnn":
+        return MtcnnFaceDetector()
+    if mode != "haar":
+        raise ValueError(f"unknown detector mode {mode!r}")
+    return HaarFaceDetector()
+
+
+def _largest(faces):
+    return max(faces, key=lambda f: f[2] * f[3]) if faces else None
+
+
+# ---------------- Face Tracking ----------------
+class FaceTracker:
+    """
+    Follows one face across frames. While a face is tracked only a padded
+    region around its last box is searched; the whole frame is searched every
+    redetect_every frames, or as soon as the face is lost.
+    The per-stream state is a plain dict {"box": [x, y, w, h] or None,
+    "age": frames since the last full detection}, so it can be kept in a
+    session or sent to another process.
+    """
+
+    def __init__(self, detector, redetect_every=REDETECT_EVERY, padding=TRACK_PADDING):
+        self.detector = detector
+        self.redetect_every = redetect_every
+        self.padding = padding
+
+    def locate(self, bgr, state):
+        """
+        Return the face box in this frame (or None) and update 'state' in place.
+        """
+        box = state.get("box")
+        age = state.get("age", 0)
+        if box is not None and age + 1 < self.redetect_every:
+            x, y, w, h = box
+            pad_x, pad_y = int(w * self.padding), int(h * self.padding)
+            x0, y0 = max(x - pad_x, 0), max(y - pad_y, 0)
+            x1, y1 = min(x + w + pad_x, bgr.shape[1]), min(y + h + pad_y, bgr.shape[0])
+            face = _largest(self.detector.detect(bgr[y0:y1, x0:x1]))
+            if face is not None:
+                state["box"] = [face[0] + x0, face[1] + y0, face[2], face[3]]
+                state["age"] = age + 1
+                return state["box"]
+        face = _largest(self.detector.detect(bgr))
+        state["box"] = None if face is None else list(face)
+        state["age"] = 0
+        return state["box"]
+
+
+# ---------------- Emotion Recognition ----------------
+class EmotionRecognizer:
+    """
+    Face detection in 'mode' plus tracking, then FER's emotion classifier on a
+    crop around the face only (FER never runs its own detector here).
+    """
+
+    def __init__(self, mode=DETECTOR_MODE, redetect_every=REDETECT_EVERY, padding=TRACK_PADDING):
+        self.mode = mode
+        self.tracker = FaceTracker(make_detector(mode), redetect_every, padding)
+        self.classifier = FER(mtcnn=False)
+
+    def classify(self, bgr, box):
+        """
+        Emotion scores {label: probability} for the face at 'box' in a BGR frame.
+        """
+        x, y, w, h = box
+        m = int(max(w, h) * CROP_MARGIN)
+        x0, y0 = max(x - m, 0), max(y - m, 0)
+        crop = bgr[y0:min(y + h + m, bgr.shape[0]), x0:min(x + w + m, bgr.shape[1])]
+        found = self.classifier.detect_emotions(crop, face_rectangles=[(x - x0, y - y0, w, h)])
+        return found[0]["emotions"] if found else None
+
+    def analyse(self, bgr, state=None):
+        """
+        Locate and classify the face in a BGR frame. Returns (emotions, state):
+        emotions is {label: probability} or None when no face is found, and
+        state is the updated tracker state to pass in with the next frame.
+        """
+        state = dict(state or {})
+        box = self.tracker.locate(bgr, state)
+        if box is None:
+            return None, state
+        return self.classify(bgr, box), state
+
+
+def top_emotion(emotions):
+    return max(emotions, key=emotions.get) if emotions else None
+
+
+# ---------------- Emotion State ----------------
+class EmotionState:
+    """
+    Per-session emotion over time: an exponentially decayed sum of the emotion
+    scores of recent frames (weights halve every half_life seconds), so one
+    odd frame doesn't flip the sentiment given to the chatbot. It also
+    suggests when the next frame is worth sending: the polling interval grows
+    while the leading emotion stays the same and holds a clear share of the
+    scores, and drops back to the minimum when it changes. With no face in
+    view for EMOTION_IDLE_FRAMES frames it doubles per empty frame instead.
+    State round-trips through to_dict()/from_dict() for the session.
+    """
+
+    def __init__(self, half_life=EMOTION_HALF_LIFE):
+        self.half_life = half_life
+        self.scores = {}
+        self.updated = None
+        self.label = None
+        self.interval_ms = EMOTION_MIN_INTERVAL_MS
+        self.misses = 0
+
+    def _decay(self, now):
+        if self.updated is not None and self.scores:
+            factor = 0.5 ** (max(now - self.updated, 0.0) / self.half_life)
+            self.scores = {k: v * factor for k, v in self.scores.items()}
+        self.updated = now
+
+    @property
+    def sentiment(self):
+        return top_emotion(self.scores) or FALLBACK_EMOTION
+
+    @property
+    def confidence(self):
+        total = sum(self.scores.values())
+        return self.scores[self.sentiment] / total if total > 0 else 0.0
+
+    def update(self, emotions, now=None):
+        """
+        Add one frame's emotion scores and return the suggested delay in ms
+        before the next frame.
+        """
+        self._decay(time.time() if now is None else now)
+        for k, v in emotions.items():
+            self.scores[k] = self.scores.get(k, 0.0) + float(v)
+        label = self.sentiment
+        returning = self.misses >= EMOTION_IDLE_FRAMES
+        self.misses = 0
+        if not returning and label == self.label and self.confidence >= EMOTION_STABLE_SHARE:
+            self.interval_ms = min(int(self.interval_ms * EMOTION_INTERVAL_GROWTH), EMOTION_MAX_INTERVAL_MS)
+        else:
+            self.interval_ms = EMOTION_MIN_INTERVAL_MS
+        self.label = label
+        return self.interval_ms
+
+    def miss(self):
+        """
+        Record a frame without a face and return the suggested delay in ms.
+        """
+        self.misses += 1
+        if self.misses >= EMOTION_IDLE_FRAMES:
+            self.interval_ms = min(self.interval_ms * 2, EMOTION_MAX_INTERVAL_MS)
+        return self.interval_ms
+
+    def to_dict(self):
+        return {
+            "scores": {k: round(v, 4) for k, v in self.scores.items()},
+            "updated": self.updated,
+            "label": self.label,
+            "interval_ms": self.interval_ms,
+            "misses": self.misses,
+        }
+
+    @classmethod
+    def from_dict(cls, data, **kwargs):
+        state = cls(**kwargs)
+        if data:
+            state.scores = dict(data.get("scores") or {})
+            state.updated = data.get("updated")
+            state.label = data.get("label")
+            state.interval_ms = data.get("interval_ms", EMOTION_MIN_INTERVAL_MS)
+            state.misses = data.get("misses", 0)
+        return state
+
+
+# ---------------- Worker Pool ----------------
+def _analyse_encoded(recognizer, encoded, state):
+    frame = cv2.imdecode(np.frombuffer(encoded, np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        return None, dict(state or {})
+    return recognizer.analyse(frame, state)
+
+
+def _worker_analyse(encoded, state, mode):
+    return _analyse_encoded(worker_resource(EmotionRecognizer, mode), encoded, state)
+
+
+class EmotionBusyError(PoolBusyError):
+    pass
+
+
+class EmotionWorkerPool(BoundedProcessPool):
+    """
+    Worker processes each holding its own EmotionRecognizer (TensorFlow models
+    are not shared between threads, so parallelism comes from processes). Jobs
+    carry the encoded frame and the caller's tracker state. With workers=0,
+    frames are recognised in the calling thread, one at a time.
+    """
+
+    def __init__(self, workers=EMOTION_WORKERS, max_queue=EMOTION_QUEUE_MAX, timeout=EMOTION_TIMEOUT,
+                 mode=DETECTOR_MODE):
+        super().__init__(workers, max_queue, timeout, initializer=worker_resource,
+                         initargs=(EmotionRecognizer, mode), busy_error=EmotionBusyError)
+        self.mode = mode
+        self._inline_lock = threading.Lock()
+
+    def submit(self, encoded, state=None):
+        """
+        Queue a frame (encoded JPEG/PNG bytes) and return a Future for
+        (emotions, state). Raises EmotionBusyError when the queue is full.
+        """
+        return self.submit_job(_worker_analyse, encoded, state, self.mode)
+
+    def analyse(self, encoded, state=None, timeout=None):
+        """
+        (emotions, state) for an encoded frame; see EmotionRecognizer.analyse.
+        Raises EmotionBusyError if the queue is full and TimeoutError if the
+        result takes longer than the timeout.
+        """
+        if self.workers == 0:
+            with self._inline_lock:
+                return _analyse_encoded(worker_resource(EmotionRecognizer, self.mode), encoded, state)
+        return self.wait(self.submit(encoded, state), timeout)
+
+    def stats(self):
+        stats = super().stats()
+        stats["mode"] = self.mode
+        return stats
+
+
+emotion_pool = EmotionWorkerPool()
+
+
+# ---------------- Benchmark ----------------
+def _read_frames(source, limit):
+    cap = cv2.VideoCapture(source)
+    frames = []
+    while len(frames) < limit:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def benchmark(frames, modes=("haar", "dnn", "mtcnn")):
+    """
+    Frames per second of EmotionRecognizer for each mode, with tracking and
+    with a full detection on every frame, plus the old full-frame
+    FER(mtcnn=True) call. Run with one thread so the numbers are per core.
+    """
+    results = {}
+
+    def run(name, fn):
+        started = time.perf_counter()
+        for frame in frames:
+            fn(frame)
+        fps = len(frames) / (time.perf_counter() - started)
+        results[name] = fps
+        print(f"{name:<22}{fps:>8.1f} fps")
+
+    for mode in modes:
+        if mode == "dnn" and not (os.path.exists(DNN_PROTO) and os.path.exists(DNN_WEIGHTS)):
+            print(f"{'dnn':<22}skipped (no model files in '{MODEL_DIR}')")
+            continue
+        for label, redetect in (("tracked", REDETECT_EVERY), ("every frame", 1)):
+            recognizer = EmotionRecognizer(mode, redetect_every=redetect)
+            state = {}
+
+            def step(frame):
+                nonlocal state
+                _, state = recognizer.analyse(frame, state)
+
+            recognizer.analyse(frames[0])  # warm-up: first call loads the classifier graph
+            run(f"{recognizer.mode} {label}", step)
+
+    legacy = FER(mtcnn=True)
+    legacy.detect_emotions(cv2.cvtColor(frames[0], cv2.COLOR_BGR2RGB))
+    run("legacy FER(mtcnn)", lambda frame: legacy.detect_emotions(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)))
+    return results
+
+
+if __name__ == "__main__":
+    # usage: python emotion_module.py [video file or camera index]
+    cv2.setNumThreads(1)
+    try:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(1)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except Exception as e:
+        print("Could not limit TensorFlow threads:", e)
+    source = sys.argv[1] if len(sys.argv) > 1 else "0"
+    frames = _read_frames(int(source) if source.isdigit() else source, 100)
+    if not frames:
+        print("No frames could be read from", source)
+    else:
+        print(f"{len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]}, 1 core")
+        benchmark(frames)
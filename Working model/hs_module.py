@@ -11,20 +11,68 @@ import cv2
 import numpy as np
 import pandas as pd
 import pickle
+import io
+import csv
+import json
 import mediapipe as mp
 import time
-from sklearn.ensemble import RandomForestClassifier
+import hashlib
+import signal
+import threading
+import tempfile
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import Future
 
 # ---------------- SETTINGS ----------------
 BASE_DIR = r"D:\New folder\MentalHealthChatbot\M MAIN\Working model"
-DATA_FILE = os.path.join(BASE_DIR, "word_data.csv")
+DATA_FILE = os.path.join(BASE_DIR, "word_data.csv")         # legacy/export format
+SAMPLES_FILE = os.path.join(BASE_DIR, "word_data.f32")     # float32 rows of TOTAL_FEATURES
+LABELS_FILE = os.path.join(BASE_DIR, "word_labels.u16")    # uint16 word code per row
+INDEX_FILE = os.path.join(BASE_DIR, "word_index.json")     # word code -> word
 REF_DIR = os.path.join(BASE_DIR, "reference_images")
 MODEL_FILE = os.path.join(BASE_DIR, "word_model.pkl")
+FLAT_MODEL_FILE = os.path.join(BASE_DIR, "word_model.npz")  # served in preference to MODEL_FILE
+VALIDATION_FILE = os.path.join(BASE_DIR, "word_model_val.npz")  # held-out rows a reloaded model must pass
 
 NUM_SAMPLES = 100
 REF_SIZE = 400
 FEATURES_PER_HAND = 21 * 3  # 21 landmarks × 3
 TOTAL_FEATURES = FEATURES_PER_HAND * 2
+
+# Features the model is trained on. The dataset always stores raw landmarks; the
+# mode is saved with the model and applied again at prediction time.
+#   "raw":             image x,y,z of every landmark
+#   "normalized":      landmarks relative to the wrist, in units of palm size
+#   "normalized_dist": normalized + distances between wrist and fingertips
+FEATURE_MODES = ("raw", "normalized", "normalized_dist")
+FEATURE_MODE = "raw"
+
+N_ESTIMATORS = 100
+TRAIN_JOBS = -1                 # cores used for training (-1 = all)
+INCREMENTAL_TREES = 50          # trees in a per-word model (incremental training)
+INCREMENTAL_TOPUP_TREES = 10    # trees added to existing word models when other words change
+INCREMENTAL_MAX_TREES = 2 * INCREMENTAL_TREES  # a word model that would grow past this is retrained from scratch
+INCREMENTAL_NEGATIVES = 1000    # cap on "other word" rows sampled per word model
+VALIDATION_EVERY = 10           # every Nth sample of a word is held out for validation
+MIN_VALIDATION_ACCURACY = 0.6   # a reloaded model scoring below this is not swapped in
+
+HANDS_POOL_MAX = 32         # max live MediaPipe trackers (one per web session)
+HANDS_IDLE_TIMEOUT = 120    # seconds before an unused tracker is closed
+
+SAMPLE_FLUSH_EVERY = 10     # captured rows buffered before they are appended to the dataset
+
+BATCH_WINDOW = 0.005        # longest wait for rows of frames still being processed
+BATCH_MAX_SIZE = 64         # the web app lowers this to its number of concurrently admitted frames
+BATCH_TIMEOUT = 2.0         # seconds a caller waits for its batched result
+
+MODEL_WATCH_INTERVAL = 2.0  # seconds between model file checks in a running server
+
+DECODER_ALPHA = 0.5          # weight of the newest frame in the smoothed probabilities
+DECODER_THRESHOLD = 0.6      # smoothed probability a word needs before it is emitted
+DECODER_MIN_FRAMES = 2       # frames in a row the word must lead before it is emitted
+DECODER_RELEASE_FRAMES = 3   # frames without a hand before the smoothing starts over
+PUNCTUATION = (".", ",", "?", "!")
 # ------------------------------------------
 
 mp_hands = mp.solutions.hands
@@ -39,39 +87,483 @@ def _ensure_dirs():
         os.makedirs(REF_DIR)
 
 
-def _frame_to_features(frame):
+# mkstemp creates files readable by the owner only; give them the mode open() would
+_umask = os.umask(0o022)
+os.umask(_umask)
+_FILE_MODE = 0o666 & ~_umask
+
+
+@contextmanager
+def _atomic_write(path, mode="wb", **kwargs):
     """
-    Given a BGR frame (numpy), detect hands and return flattened feature vector:
-    63 coords for each hand (x,y,z). If second hand missing, pad with zeros.
-    Returns None if no hands detected.
+    Open a uniquely named temp file next to 'path'; it replaces 'path' when the
+    with block completes and is removed if the block fails. Readers never see a
+    half-written file, and concurrent writers never share a temp file.
     """
-    with mp_hands.Hands(static_image_mode=False, max_num_hands=2, min_detection_confidence=0.5) as hands:
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = hands.process(rgb)
-        if not results.multi_hand_landmarks:
-            return None
-        data_row = []
-        # first hand
-        hand1 = results.multi_hand_landmarks[0]
-        for lm in hand1.landmark:
-            data_row.extend([lm.x, lm.y, lm.z])
-        # second hand if exists
-        if len(results.multi_hand_landmarks) > 1:
-            hand2 = results.multi_hand_landmarks[1]
-            for lm in hand2.landmark:
-                data_row.extend([lm.x, lm.y, lm.z])
-        else:
-            data_row.extend([0] * FEATURES_PER_HAND)
-        return data_row
+    fd, tmp_file = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp",
+                                    dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, mode, **kwargs) as f:
+            os.chmod(tmp_file, _FILE_MODE)
+            yield f
+        os.replace(tmp_file, path)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+class HandsPool:
+    """
+    Long-lived MediaPipe Hands trackers keyed by session, so consecutive frames
+    from the same webcam reuse landmark tracking (static_image_mode=False)
+    instead of re-initialising the graph every frame.
+    Trackers idle for more than idle_timeout seconds are closed, and when the
+    pool is full the least recently used one is evicted.
+    """
+
+    def __init__(self, max_size=HANDS_POOL_MAX, idle_timeout=HANDS_IDLE_TIMEOUT):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> {"hands", "features", "lock", "last_used", "closed"}
+
+    def _new_entry(self):
+        hands = mp_hands.Hands(static_image_mode=False, max_num_hands=2, min_detection_confidence=0.5)
+        return {"hands": hands, "features": new_feature_buffer(), "lock": threading.Lock(), "last_used": time.time(),
+                "closed": False}
+
+    def _acquire(self, key):
+        evicted = []
+        with self._lock:
+            now = time.time()
+            for k, e in list(self._entries.items()):
+                if now - e["last_used"] > self.idle_timeout:
+                    evicted.append(self._entries.pop(k))
+            entry = self._entries.get(key)
+            if entry is None:
+                while len(self._entries) >= self.max_size:
+                    evicted.append(self._entries.popitem(last=False)[1])
+                entry = self._new_entry()
+                self._entries[key] = entry
+            else:
+                self._entries.move_to_end(key)
+            entry["last_used"] = now
+        for e in evicted:
+            self._close(e)
+        return entry
+
+    @staticmethod
+    def _close(entry):
+        # wait for any frame still being processed on this tracker
+        with entry["lock"]:
+            entry["closed"] = True
+            entry["hands"].close()
+
+    @contextmanager
+    def session(self, key):
+        """
+        Hold the entry for 'key' (its tracker and feature buffer) for the
+        duration of the with block. Frames for the same key are handled one
+        at a time.
+        """
+        entry = self._acquire(key)
+        entry["lock"].acquire()
+        # another thread may have evicted and closed the entry before we got
+        # its lock; _acquire then starts a fresh one for this key
+        while entry["closed"]:
+            entry["lock"].release()
+            entry = self._acquire(key)
+            entry["lock"].acquire()
+        try:
+            yield entry
+        finally:
+            entry["lock"].release()
+
+    def process(self, key, rgb):
+        # Run hand detection on an RGB frame using the tracker for 'key'.
+        with self.session(key) as entry:
+            return entry["hands"].process(rgb)
+
+    def release(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._close(entry)
+
+    def close_all(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for e in entries:
+            self._close(e)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+hands_pool = HandsPool()
+
+
+def new_feature_buffer():
+    return np.zeros(TOTAL_FEATURES, dtype=np.float32)
+
+
+def _hand_order(results):
+    # with two hands, the left hand always goes first so the layout doesn't depend on detection order
+    hands = results.multi_hand_landmarks
+    if len(hands) < 2 or not results.multi_handedness:
+        return hands[:2]
+    labels = [h.classification[0].label for h in results.multi_handedness[:2]]
+    if labels == ["Right", "Left"]:
+        return [hands[1], hands[0]]
+    return hands[:2]
+
+
+def extract_features(results, out=None):
+    """
+    Write the landmarks of a MediaPipe Hands result into 'out' (a float32
+    buffer of TOTAL_FEATURES, allocated if not given) and return it, or None
+    if no hands were detected. Layout: x,y,z of the 21 landmarks of the first
+    hand, then of the second hand (zeros if there is only one). Two hands are
+    ordered left, right. The buffer is overwritten by the next call, so copy
+    it if the row has to outlive the frame.
+    """
+    if not results.multi_hand_landmarks:
+        return None
+    if out is None:
+        out = new_feature_buffer()
+    hands = _hand_order(results)
+    for slot, hand in enumerate(hands):
+        start = slot * FEATURES_PER_HAND
+        out[start:start + FEATURES_PER_HAND] = np.fromiter(
+            (v for lm in hand.landmark for v in (lm.x, lm.y, lm.z)), dtype=np.float32, count=FEATURES_PER_HAND)
+    out[len(hands) * FEATURES_PER_HAND:] = 0.0
+    return out
+
+
+_DIST_POINTS = [0, 4, 8, 12, 16, 20]  # wrist and fingertips
+_DIST_PAIRS = np.triu_indices(len(_DIST_POINTS), 1)
+
+
+def transform_features(X, mode=FEATURE_MODE):
+    """
+    Turn raw landmark rows (n, TOTAL_FEATURES) into model input for 'mode'
+    (see FEATURE_MODES). Normalized modes translate each hand to its wrist and
+    divide by the wrist to middle-knuckle distance, so the features don't
+    depend on where the hand is in the frame or how close it is to the camera;
+    the second hand's position relative to the first is kept as 3 extra values.
+    A missing hand stays all zeros.
+    """
+    X = np.asarray(X, dtype=np.float32)
+    if mode == "raw":
+        return X
+    if mode not in FEATURE_MODES:
+        raise ValueError(f"unknown feature mode {mode!r}")
+    n = len(X)
+    hands = X.reshape(n, 2, 21, 3)
+    present = np.any(hands != 0, axis=(2, 3))
+    rel = hands - hands[:, :, :1, :]
+    scale = np.linalg.norm(rel[:, :, 9, :2], axis=2)
+    scale = np.where(scale > 1e-6, scale, 1.0)
+    rel /= scale[:, :, None, None]
+    rel[~present] = 0.0
+    offset = (hands[:, 1, 0, :] - hands[:, 0, 0, :]) / scale[:, :1]
+    offset[~present[:, 1]] = 0.0
+    parts = [rel.reshape(n, -1), offset]
+    if mode == "normalized_dist":
+        points = rel[:, :, _DIST_POINTS, :]
+        i, j = _DIST_PAIRS
+        parts.append(np.linalg.norm(points[:, :, i, :] - points[:, :, j, :], axis=3).reshape(n, -1))
+    return np.ascontiguousarray(np.concatenate(parts, axis=1), dtype=np.float32)
+
+
+def model_features(model, X):
+    # input for 'model' from raw rows, in the feature mode it was trained with
+    return transform_features(X, getattr(model, "feature_mode_", "raw"))
+
+
+def _frame_to_features(frame, session_key=None, out=None):
+    """
+    Given a BGR frame (numpy), detect hands and return the feature vector from
+    extract_features, or None if no hands detected.
+    With a session_key the persistent tracker for that session from hands_pool
+    is used; without one a throwaway tracker is created for this frame only.
+    """
+    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    if session_key is not None:
+        results = hands_pool.process(session_key, rgb)
+    else:
+        with mp_hands.Hands(static_image_mode=True, max_num_hands=2, min_detection_confidence=0.5) as hands:
+            results = hands.process(rgb)
+    return extract_features(results, out)
+
+
+# ---------------- Dataset ----------------
+ROW_BYTES = TOTAL_FEATURES * 4
+
+
+class SampleStore:
+    """
+    Columnar binary training set. Landmark rows are raw float32 in SAMPLES_FILE
+    (appended in place, read back memory-mapped), with a parallel uint16 word
+    code per row in LABELS_FILE. INDEX_FILE maps codes to words and lists
+    deleted codes: deleting a word only tombstones its code, and compact()
+    physically drops tombstoned rows later. A word collected again after
+    deletion gets a fresh code, so its old rows stay deleted.
+    The row count is whatever both column files fully contain, so a torn
+    append is simply ignored (and trimmed by the next writer).
+    """
+
+    def __init__(self, samples_file=SAMPLES_FILE, labels_file=LABELS_FILE, index_file=INDEX_FILE):
+        self.samples_file = samples_file
+        self.labels_file = labels_file
+        self.index_file = index_file
+        # held by writers, readers, index updates and compaction so they never interleave within this process
+        self.lock = threading.RLock()
+
+    # ---- index ----
+    def load_index(self):
+        if not os.path.exists(self.index_file):
+            return {"words": [], "deleted": []}
+        with open(self.index_file, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        index.setdefault("deleted", [])
+        return index
+
+    def save_index(self, index):
+        with _atomic_write(self.index_file, "w", encoding="utf-8") as f:
+            json.dump(index, f, indent=1)
+
+    @staticmethod
+    def _live_code(index, word):
+        for code in range(len(index["words"]) - 1, -1, -1):
+            if index["words"][code] == word and code not in index["deleted"]:
+                return code
+        return None
+
+    def word_code(self, word):
+        """
+        Live code for 'word', adding a new one to the index if needed.
+        """
+        with self.lock:
+            index = self.load_index()
+            code = self._live_code(index, word)
+            if code is None:
+                index["words"].append(word)
+                self.save_index(index)
+                code = len(index["words"]) - 1
+            return code
+
+    def delete_word(self, word):
+        """
+        Tombstone 'word': an index-only update, the rows stay on disk until compact().
+        Returns False if the word has no live code. Waits for a running
+        compact(), which renumbers the codes.
+        """
+        with self.lock:
+            index = self.load_index()
+            code = self._live_code(index, word)
+            if code is None:
+                return False
+            index["deleted"].append(code)
+            self.save_index(index)
+            return True
+
+    # ---- rows ----
+    def __len__(self):
+        try:
+            n_samples = os.path.getsize(self.samples_file) // ROW_BYTES
+            n_labels = os.path.getsize(self.labels_file) // 2
+        except OSError:
+            return 0
+        return min(n_samples, n_labels)
+
+    def load_codes(self):
+        with self.lock:
+            n = len(self)
+            if n == 0:
+                return np.empty(0, dtype=np.uint16)
+            return np.fromfile(self.labels_file, dtype="<u2", count=n)
+
+    def load(self):
+        """
+        Return (X, y) for all non-deleted rows: X is a float32 matrix
+        (n, TOTAL_FEATURES), memory-mapped when nothing is tombstoned,
+        y the word of each row.
+        """
+        with self.lock:
+            n = len(self)
+            if n == 0:
+                return np.empty((0, TOTAL_FEATURES), dtype=np.float32), np.empty(0, dtype=str)
+            index = self.load_index()
+            X = np.memmap(self.samples_file, dtype="<f4", mode="r", shape=(n, TOTAL_FEATURES))
+            codes = self.load_codes()
+            if index["deleted"]:
+                live = ~np.isin(codes, index["deleted"])
+                X, codes = X[live], codes[live]
+            words = np.asarray(index["words"] or [""], dtype=str)
+            return X, words[codes]
+
+    def counts(self):
+        """
+        Number of non-deleted rows per word.
+        """
+        with self.lock:
+            index = self.load_index()
+            codes, counts = np.unique(self.load_codes(), return_counts=True)
+            result = {}
+            for c, k in zip(codes, counts):
+                if c not in index["deleted"]:
+                    word = index["words"][c]
+                    result[word] = result.get(word, 0) + int(k)
+            return result
+
+    def live_rows(self):
+        return sum(self.counts().values())
+
+    def repair(self):
+        # cut both column files back to the last complete row
+        n = len(self)
+        for path, row_bytes in ((self.samples_file, ROW_BYTES), (self.labels_file, 2)):
+            if os.path.exists(path) and os.path.getsize(path) != n * row_bytes:
+                with open(path, "rb+") as f:
+                    f.truncate(n * row_bytes)
+                print("Removed an incomplete last row from", path)
+
+    def compact(self):
+        """
+        Physically drop tombstoned rows and renumber the remaining codes.
+        """
+        with self.lock:
+            index = self.load_index()
+            if not index["deleted"]:
+                return 0
+            old_codes = self.load_codes()
+            words = []
+            remap = np.full(max(len(index["words"]), 1), -1, dtype=np.int32)
+            for code, word in enumerate(index["words"]):
+                if code in index["deleted"]:
+                    continue
+                if word not in words:
+                    words.append(word)
+                remap[code] = words.index(word)
+            new_codes = remap[old_codes]
+            keep = new_codes >= 0
+            X = np.memmap(self.samples_file, dtype="<f4", mode="r", shape=(len(old_codes), TOTAL_FEATURES))
+            samples = np.ascontiguousarray(X[keep], dtype="<f4")
+            del X  # release the memory map before replacing the file (required on Windows)
+            for path, data in ((self.samples_file, samples), (self.labels_file, new_codes[keep].astype("<u2"))):
+                with _atomic_write(path) as f:
+                    data.tofile(f)
+                    f.flush()
+                    os.fsync(f.fileno())
+            self.save_index({"words": words, "deleted": []})
+            return int((~keep).sum())
+
+    # ---- CSV compatibility ----
+    def migrate_csv(self, csv_file=DATA_FILE):
+        """
+        One-shot import of the legacy CSV (126 features + word per row).
+        Only runs while the binary dataset has never been created.
+        """
+        if os.path.exists(self.index_file) or not os.path.exists(csv_file):
+            return 0
+        df = pd.read_csv(csv_file, header=None)
+        X = df.iloc[:, :-1].to_numpy(dtype=np.float32)
+        y = df.iloc[:, -1].astype(str).str.upper().to_numpy()
+        with SampleWriter(self, flush_every=len(df) + 1) as writer:
+            for row, word in zip(X, y):
+                writer.add(row, word)
+        print(f"Migrated {len(df)} rows from '{csv_file}' to '{self.samples_file}'.")
+        return len(df)
+
+    def export_csv(self, csv_file=DATA_FILE):
+        """
+        Write the dataset in the legacy CSV layout.
+        """
+        X, y = self.load()
+        with _atomic_write(csv_file, "w", newline="") as f:
+            writer = csv.writer(f)
+            for row, word in zip(X, y):
+                # shortest text that reads back as the same float32
+                writer.writerow([str(v) for v in row] + [word])
+        print(f"Exported {len(y)} rows to '{csv_file}'.")
+
+
+class SampleWriter:
+    """
+    Appends feature rows to a SampleStore without ever rewriting existing data.
+    Rows are buffered and appended in batches of flush_every; close() writes
+    the remainder and fsyncs. Use it as a context manager so an ESC/abort still
+    keeps everything captured so far.
+    """
+
+    def __init__(self, store=None, flush_every=SAMPLE_FLUSH_EVERY):
+        self.store = store if store is not None else sample_store
+        self.flush_every = flush_every
+        self.written = 0
+        self._codes = {}
+        self._rows = np.empty((flush_every, TOTAL_FEATURES), dtype="<f4")
+        self._labels = np.empty(flush_every, dtype="<u2")
+        self._pending = 0
+        self.store.lock.acquire()
+        self.store.repair()
+        self._samples = open(self.store.samples_file, "ab")
+        self._labels_f = open(self.store.labels_file, "ab")
+
+    def add(self, row, word):
+        code = self._codes.get(word)
+        if code is None:
+            code = self._codes[word] = self.store.word_code(word)
+        self._rows[self._pending] = row
+        self._labels[self._pending] = code
+        self._pending += 1
+        if self._pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            # samples first: a row only counts once its label is written too
+            self._samples.write(self._rows[:self._pending].tobytes())
+            self._samples.flush()
+            self._labels_f.write(self._labels[:self._pending].tobytes())
+            self._labels_f.flush()
+            self.written += self._pending
+            self._pending = 0
+
+    def close(self):
+        if self._samples.closed:
+            return
+        self.flush()
+        for f in (self._samples, self._labels_f):
+            os.fsync(f.fileno())
+            f.close()
+        self.store.lock.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+sample_store = SampleStore()
+
+
+def _ensure_dataset():
+    # first run after upgrading: import the legacy CSV into the binary dataset
+    if not os.path.exists(sample_store.index_file) and os.path.exists(DATA_FILE):
+        sample_store.migrate_csv(DATA_FILE)
 
 
 # ---------------- MODE: Collect Data ----------------
 def collect_data(num_samples: int = NUM_SAMPLES):
     """
     Interactive data capture for a word: captures NUM_SAMPLES feature rows
-    and saves into DATA_FILE, then optionally captures a reference photo.
+    and appends them to the dataset, then optionally captures a reference photo.
     """
     _ensure_dirs()
+    _ensure_dataset()
     word = input("Enter the word to collect (A-Z only): ").strip().upper()
     if not word.isalpha():
         print("Invalid word! Only alphabets allowed.")
@@ -79,12 +571,13 @@ def collect_data(num_samples: int = NUM_SAMPLES):
 
     n_samples = num_samples
     cap = cv2.VideoCapture(0)
-    with mp_hands.Hands(max_num_hands=2, min_detection_confidence=0.7) as hands:
+    with mp_hands.Hands(max_num_hands=2, min_detection_confidence=0.7) as hands, SampleWriter() as writer:
         collected = 0
         last_time = 0
         cooldown_time = 0.3
 
         print(f"Collecting {n_samples} samples for '{word}'... (Press ESC to abort)")
+        features = new_feature_buffer()
         while collected < n_samples:
             ret, frame = cap.read()
             if not ret:
@@ -102,28 +595,8 @@ def collect_data(num_samples: int = NUM_SAMPLES):
                     continue
                 last_time = current_time
 
-                data_row = []
-                hand1 = results.multi_hand_landmarks[0]
-                for lm in hand1.landmark:
-                    data_row.extend([lm.x, lm.y, lm.z])
-                if len(results.multi_hand_landmarks) > 1:
-                    hand2 = results.multi_hand_landmarks[1]
-                    for lm in hand2.landmark:
-                        data_row.extend([lm.x, lm.y, lm.z])
-                else:
-                    data_row.extend([0] * FEATURES_PER_HAND)
-
-                data_row.append(word)
-
-                # Save to CSV (append)
-                if not os.path.exists(DATA_FILE):
-                    df = pd.DataFrame([data_row])
-                    df.to_csv(DATA_FILE, index=False, header=False)
-                else:
-                    df_existing = pd.read_csv(DATA_FILE, header=None)
-                    df_new = pd.DataFrame([data_row])
-                    df_combined = pd.concat([df_existing, df_new], ignore_index=True)
-                    df_combined.to_csv(DATA_FILE, index=False, header=False)
+                # Append to the dataset (buffered; flushed in batches and on exit)
+                writer.add(extract_features(results, features), word)
 
                 collected += 1
 
@@ -176,25 +649,378 @@ def collect_data(num_samples: int = NUM_SAMPLES):
 
 
 # ---------------- MODE: Train Model ----------------
-def train_model():
+# held while training or rewriting the model files, so the background rebuild
+# after a deletion and training started from the CLI run one at a time
+_training_lock = threading.RLock()
+
+
+class WordModelSet:
     """
-    Train a RandomForestClassifier on DATA_FILE and write MODEL_FILE.
+    One-vs-rest set of per-word forests, used by incremental training. Each
+    word's forest separates that word's rows from a bounded sample of other
+    words' rows, so adding or re-collecting one word costs time proportional to
+    its own samples, and deleting a word just drops its forest.
+    predict_proba returns each word's own score (rows are not normalised).
     """
-    if not os.path.exists(DATA_FILE):
-        print("No data found! Collect data first.")
-        return
 
-    df = pd.read_csv(DATA_FILE, header=None)
-    X = df.iloc[:, :-1].values
-    y = df.iloc[:, -1].values
+    def __init__(self, feature_mode="raw"):
+        self.models = {}   # word -> binary RandomForestClassifier (1 = this word)
+        self.counts = {}   # word -> number of its rows the model was trained on
+        self.feature_mode_ = feature_mode
+
+    @property
+    def classes_(self):
+        return np.asarray(sorted(self.models), dtype=str)
+
+    @staticmethod
+    def positive_column(model):
+        classes = list(model.classes_)
+        return classes.index(1) if 1 in classes else None
+
+    def predict_proba(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        columns = []
+        for word in self.classes_:
+            model = self.models[word]
+            col = self.positive_column(model)
+            columns.append(np.zeros(len(X)) if col is None else model.predict_proba(X)[:, col])
+        return np.column_stack(columns)
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1))
+
+
+def _sample_rows(mask, limit, rng):
+    rows = np.flatnonzero(mask)
+    if len(rows) > limit:
+        rows = np.sort(rng.choice(rows, size=limit, replace=False))
+    return rows
+
+
+def _train_incremental(X, y, previous, feature_mode):
+    from sklearn.ensemble import RandomForestClassifier
+
+    rng = np.random.default_rng()
+    model = previous
+    if not isinstance(model, WordModelSet) or getattr(model, "feature_mode_", "raw") != feature_mode:
+        model = WordModelSet(feature_mode)
+    counts = dict(zip(*np.unique(y, return_counts=True)))
+    for word in [w for w in model.models if w not in counts]:
+        del model.models[word]
+        del model.counts[word]
+        print(f" - dropped model for '{word}'")
+    changed = [w for w in counts if model.counts.get(w) != counts[w]]
+
+    def retrain(word):
+        pos = np.flatnonzero(y == word)
+        neg = _sample_rows(y != word, INCREMENTAL_NEGATIVES, rng)
+        rows = np.concatenate([pos, neg])
+        clf = RandomForestClassifier(n_estimators=INCREMENTAL_TREES, n_jobs=TRAIN_JOBS)
+        clf.fit(X[rows], (y[rows] == word).astype(int))
+        model.models[word] = clf
+        model.counts[word] = int(counts[word])
+        print(f" - trained model for '{word}' ({len(pos)} samples, {len(neg)} negatives)")
+
+    for word in changed:
+        retrain(word)
+
+    # existing word models have never seen the changed words: add a few trees that have,
+    # or start over once the forest would exceed INCREMENTAL_MAX_TREES so it stays cheap to serve
+    changed_mask = np.isin(y, changed)
+    for word in [w for w in model.models if w not in changed] if changed else []:
+        if len(model.models[word].estimators_) + INCREMENTAL_TOPUP_TREES > INCREMENTAL_MAX_TREES:
+            retrain(word)
+            continue
+        pos = _sample_rows(y == word, INCREMENTAL_NEGATIVES, rng)
+        neg = _sample_rows(changed_mask, INCREMENTAL_NEGATIVES, rng)
+        rows = np.concatenate([pos, neg])
+        clf = model.models[word]
+        clf.set_params(warm_start=True, n_estimators=len(clf.estimators_) + INCREMENTAL_TOPUP_TREES)
+        clf.fit(X[rows], (y[rows] == word).astype(int))
+        print(f" - added {INCREMENTAL_TOPUP_TREES} trees to '{word}'")
+    return model
+
+
+def _validation_mask(y):
+    # every VALIDATION_EVERY-th sample of each word; based on the rank within the word,
+    # so changing one word's samples doesn't move other words' rows between the sets
+    mask = np.zeros(len(y), dtype=bool)
+    for word in np.unique(y):
+        rows = np.flatnonzero(y == word)
+        if len(rows) >= VALIDATION_EVERY:
+            mask[rows[VALIDATION_EVERY - 1::VALIDATION_EVERY]] = True
+    return mask
+
+
+def save_validation_set(X, y, path=VALIDATION_FILE):
+    with _atomic_write(path) as f:
+        np.savez_compressed(f, X=np.asarray(X, dtype=np.float32), y=np.asarray(y).astype(str))
+
+
+def load_validation_set(path=VALIDATION_FILE):
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as data:
+        return data["X"], data["y"]
+
 
-    clf = RandomForestClassifier(n_estimators=100)
-    clf.fit(X, y)
-    print("Model trained!")
+def train_model(incremental: bool = False):
+    """
+    Train on the dataset and write MODEL_FILE, plus its flattened copy
+    FLAT_MODEL_FILE for serving. The default is a RandomForestClassifier over
+    all data using TRAIN_JOBS cores; incremental=True updates a WordModelSet,
+    retraining only the words whose samples changed since the last run.
+    Held-out rows are written to VALIDATION_FILE first, so a running server
+    can check the new model before swapping it in.
+    """
+    from sklearn.ensemble import RandomForestClassifier
+
+    with _training_lock:
+        _ensure_dataset()
+        X, y = sample_store.load()
+        if len(y) == 0:
+            print("No data found! Collect data first.")
+            return
+
+        print("Samples per word:")
+        for word, count in sorted(sample_store.counts().items()):
+            print(f" - {word}: {count}")
+
+        val_mask = _validation_mask(y)
+        X_val, y_val = X[val_mask], y[val_mask]
+        save_validation_set(X_val, y_val)
+        X, y = transform_features(X[~val_mask], FEATURE_MODE), y[~val_mask]
+
+        started = time.perf_counter()
+        if incremental:
+            clf = _train_incremental(X, y, load_model(), FEATURE_MODE)
+        else:
+            clf = RandomForestClassifier(n_estimators=N_ESTIMATORS, n_jobs=TRAIN_JOBS)
+            clf.fit(X, y)
+            clf.feature_mode_ = FEATURE_MODE
+        print(f"Model trained! ({time.perf_counter() - started:.2f}s wall time, {len(y)} samples, '{FEATURE_MODE}' features)")
+        if len(y_val):
+            accuracy = np.mean(clf.predict(model_features(clf, X_val)) == y_val)
+            print(f"Held-out accuracy: {accuracy:.3f} ({len(y_val)} samples)")
+
+        # write to a temp file and swap it in, so a running server never sees a half-written pickle
+        with _atomic_write(MODEL_FILE) as f:
+            pickle.dump(clf, f)
+        print(f"Model saved as '{MODEL_FILE}'")
+
+        FlatForest.from_sklearn(clf).save(FLAT_MODEL_FILE)
+        print(f"Flat model saved as '{FLAT_MODEL_FILE}'")
+
+
+# ---------------- Flat Model ----------------
+class FlatForest:
+    """
+    Array-based copy of a trained RandomForestClassifier (or WordModelSet). The
+    nodes of all trees are concatenated into flat NumPy arrays (split feature,
+    threshold, children, per-node class probabilities) and a whole batch walks
+    every tree at once. Predicts the same labels as the sklearn model without
+    importing sklearn. Leaves point to themselves, so every row can take
+    exactly max_depth steps. feature_mode_ is the FEATURE_MODES entry the
+    forest was trained on.
+    """
+
+    def __init__(self, classes, feature, threshold, left, right, value, roots, max_depth, feature_mode="raw"):
+        self.classes_ = classes
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.feature_mode_ = str(feature_mode)
+
+    @staticmethod
+    def _tree_proba(tree):
+        # same normalisation as DecisionTreeClassifier.predict_proba
+        value = tree.value[:, 0, :].astype(np.float64)
+        normalizer = value.sum(axis=1, keepdims=True)
+        normalizer[normalizer == 0.0] = 1.0
+        return value / normalizer
 
-    with open(MODEL_FILE, "wb") as f:
-        pickle.dump(clf, f)
-    print(f"Model saved as '{MODEL_FILE}'")
+    @classmethod
+    def from_sklearn(cls, model):
+        if isinstance(model, WordModelSet):
+            flat = cls._from_word_models(model)
+        else:
+            flat = cls._from_trees(model.classes_, [(est.tree_, cls._tree_proba(est.tree_)) for est in model.estimators_])
+        flat.feature_mode_ = getattr(model, "feature_mode_", "raw")
+        return flat
+
+    @classmethod
+    def _from_word_models(cls, model):
+        # column w of a tree in word w's forest holds P(w) scaled by total/own tree count,
+        # so averaging over all trees gives each word's own forest mean
+        words = model.classes_
+        n_trees = sum(len(model.models[w].estimators_) for w in words)
+        trees = []
+        for i, word in enumerate(words):
+            forest = model.models[word]
+            col = WordModelSet.positive_column(forest)
+            scale = n_trees / len(forest.estimators_)
+            for est in forest.estimators_:
+                value = np.zeros((est.tree_.node_count, len(words)))
+                if col is not None:
+                    value[:, i] = cls._tree_proba(est.tree_)[:, col] * scale
+                trees.append((est.tree_, value))
+        return cls._from_trees(words, trees)
+
+    @classmethod
+    def _from_trees(cls, classes, trees):
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for tree, value in trees:
+            n = tree.node_count
+            is_leaf = tree.children_left == -1
+            idx = np.arange(n)
+            roots.append(offset)
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+            lefts.append(np.where(is_leaf, idx, tree.children_left) + offset)
+            rights.append(np.where(is_leaf, idx, tree.children_right) + offset)
+            values.append(value)
+            max_depth = max(max_depth, tree.max_depth)
+            offset += n
+        return cls(
+            classes=np.asarray(classes).astype(str),
+            feature=np.concatenate(features).astype(np.int32),
+            threshold=np.concatenate(thresholds).astype(np.float64),
+            left=np.concatenate(lefts).astype(np.int32),
+            right=np.concatenate(rights).astype(np.int32),
+            value=np.concatenate(values),
+            roots=np.asarray(roots, dtype=np.int32),
+            max_depth=max_depth,
+        )
+
+    def to_bytes(self):
+        buf = io.BytesIO()
+        np.savez_compressed(
+            buf, classes=self.classes_, feature=self.feature, threshold=self.threshold,
+            left=self.left, right=self.right, value=self.value, roots=self.roots,
+            max_depth=np.int32(self.max_depth), feature_mode=np.str_(self.feature_mode_),
+        )
+        return buf.getvalue()
+
+    def save(self, path):
+        with _atomic_write(path) as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def from_bytes(cls, raw):
+        with np.load(io.BytesIO(raw), allow_pickle=False) as data:
+            # files written before feature modes existed are raw
+            feature_mode = str(data["feature_mode"]) if "feature_mode" in data.files else "raw"
+            return cls(
+                classes=data["classes"], feature=data["feature"], threshold=data["threshold"],
+                left=data["left"], right=data["right"], value=data["value"],
+                roots=data["roots"], max_depth=data["max_depth"], feature_mode=feature_mode,
+            )
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
+
+    def predict_proba(self, X):
+        # float32 input vs float64 thresholds, exactly like sklearn's tree traversal
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        rows = np.arange(X.shape[0])[:, None]
+        node = np.broadcast_to(self.roots, (X.shape[0], self.roots.size)).copy()
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[node]] <= self.threshold[node]
+            node = np.where(go_left, self.left[node], self.right[node])
+        # accumulate tree by tree in order, matching RandomForestClassifier.predict_proba
+        proba = self.value[node[:, 0]].copy()
+        for t in range(1, node.shape[1]):
+            proba += self.value[node[:, t]]
+        proba /= node.shape[1]
+        return proba
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1))
+
+    def without_classes(self, words):
+        """
+        Copy of this forest that can no longer predict 'words' (their probability
+        columns are dropped; the remaining ones are left unnormalised).
+        """
+        keep = ~np.isin(self.classes_, list(words))
+        return FlatForest(self.classes_[keep], self.feature, self.threshold, self.left, self.right,
+                          np.ascontiguousarray(self.value[:, keep]), self.roots, self.max_depth, self.feature_mode_)
+
+
+def benchmark_features(modes=FEATURE_MODES, repeats=200):
+    """
+    Train a forest per feature mode on the dataset and compare held-out
+    accuracy, flat model size and node count, and prediction latency for one
+    row and for a batch of BATCH_MAX_SIZE rows (feature transform included).
+    Returns {mode: results}. Nothing is saved.
+    """
+    from sklearn.ensemble import RandomForestClassifier
+
+    with _training_lock:
+        _ensure_dataset()
+        X, y = sample_store.load()
+        val_mask = _validation_mask(y)
+        if not val_mask.any():
+            print("Not enough data for a held-out set! Collect data first.")
+            return {}
+        X_train, y_train = X[~val_mask], y[~val_mask]
+        X_val, y_val = np.asarray(X[val_mask]), y[val_mask]
+        batch = X_val[np.arange(BATCH_MAX_SIZE) % len(X_val)]
+
+        print(f"{len(y_train)} training / {len(y_val)} held-out samples, {N_ESTIMATORS} trees")
+        print(f"{'mode':<16}{'accuracy':>9}{'size KB':>9}{'nodes':>8}{'1 row ms':>10}{'batch ms':>10}{'train s':>9}")
+        results = {}
+        for mode in modes:
+            started = time.perf_counter()
+            clf = RandomForestClassifier(n_estimators=N_ESTIMATORS, n_jobs=TRAIN_JOBS)
+            clf.fit(transform_features(X_train, mode), y_train)
+            clf.feature_mode_ = mode
+            train_s = time.perf_counter() - started
+            flat = FlatForest.from_sklearn(clf)
+
+            accuracy = float(np.mean(flat.predict(model_features(flat, X_val)) == y_val))
+            timings = []
+            for rows, n in ((X_val[:1], repeats), (batch, max(1, repeats // 10))):
+                started = time.perf_counter()
+                for _ in range(n):
+                    flat.predict_proba(model_features(flat, rows))
+                timings.append((time.perf_counter() - started) / n * 1000)
+            results[mode] = {
+                "accuracy": accuracy, "size_bytes": len(flat.to_bytes()), "nodes": len(flat.feature),
+                "row_ms": timings[0], "batch_ms": timings[1], "train_s": train_s,
+            }
+            r = results[mode]
+            print(f"{mode:<16}{accuracy:>9.3f}{r['size_bytes'] / 1024:>9.1f}{r['nodes']:>8}"
+                  f"{r['row_ms']:>10.3f}{r['batch_ms']:>10.3f}{train_s:>9.2f}")
+        print(f"Models are trained with FEATURE_MODE = '{FEATURE_MODE}'.")
+        return results
+
+
+def export_flat_model():
+    """
+    Write FLAT_MODEL_FILE from an existing MODEL_FILE (for models trained before
+    the flat format existed). Needs sklearn to read the pickle.
+    """
+    with _training_lock:
+        clf = load_model()
+        if clf is None:
+            print("No trained model found! Train data first.")
+            return
+        FlatForest.from_sklearn(clf).save(FLAT_MODEL_FILE)
+        print(f"Flat model saved as '{FLAT_MODEL_FILE}' "
+              f"({os.path.getsize(FLAT_MODEL_FILE) / 1024:.0f} KB vs {os.path.getsize(MODEL_FILE) / 1024:.0f} KB pickle)")
 
 
 # ---------------- MODE: Predict From Frame ----------------
@@ -206,35 +1032,472 @@ def load_model():
     return clf
 
 
-def predict_from_frame(frame, clf=None):
+class ModelRegistry:
+    """
+    Keeps the trained classifier resident in memory. 'sources' is a list of
+    (path, loader) pairs in order of preference; the first file that exists is
+    served. A file is only re-read when its mtime/size changes, and only
+    deserialised again when the content hash differs. A new model replacing a
+    loaded one must first score at least min_accuracy on the held-out
+    validation set, otherwise the old one keeps serving. Swaps are atomic:
+    readers always get either the old or the new model, never a partial one.
+
+    By default every get() checks the file; after watch() a background thread
+    does the checking instead and get() is a plain attribute read.
+    """
+
+    def __init__(self, sources=None, validation_file=VALIDATION_FILE, min_accuracy=MIN_VALIDATION_ACCURACY):
+        if sources is None:
+            sources = [(FLAT_MODEL_FILE, FlatForest.from_bytes), (MODEL_FILE, pickle.loads)]
+        self.sources = sources
+        self.validation_file = validation_file
+        self.min_accuracy = min_accuracy
+        self._watcher = None
+        self._wake = threading.Event()
+        self.rejected = 0
+        self.path = None
+        self._loader = None
+        self._lock = threading.Lock()
+        self._model = None
+        self._signature = None
+        self._digest = None
+        self.load_count = 0
+        self.last_reload = None
+
+    def _file_signature(self):
+        for path, _ in self.sources:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            return (path, st.st_mtime_ns, st.st_size)
+        return None
+
+    def get(self):
+        """
+        Return the current classifier (or None if no model file exists),
+        reloading it first if the file changed on disk (unless the watcher
+        thread is taking care of that).
+        """
+        if self._watcher is not None:
+            return self._model
+        return self.refresh()
+
+    def refresh(self):
+        # check the file now and reload it if it changed
+        signature = self._file_signature()
+        if signature == self._signature:
+            return self._model
+        with self._lock:
+            if signature != self._signature:
+                self._reload(signature)
+            return self._model
+
+    def _reload(self, signature):
+        if signature is None:
+            self._model, self._digest = None, None
+            self._signature = None
+            self.path = None
+            return
+        path = signature[0]
+        loader = dict(self.sources)[path]
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+        except OSError as e:
+            print("Model reload error:", e)
+            return
+        digest = hashlib.sha1(raw).hexdigest()
+        if digest != self._digest:
+            try:
+                model = loader(raw)
+                self._validate(model)
+            except Exception as e:
+                # keep serving the previous model; retry on the next change
+                print("Model reload error:", e)
+                self._signature = signature
+                self.rejected += 1
+                return
+            self._model, self._digest = model, digest
+            self.path = path
+            self.load_count += 1
+            self.last_reload = time.time()
+        self._signature = signature
+
+    def _validate(self, model):
+        # the first model is always served; replacements have to prove themselves
+        if self._model is None:
+            return
+        val = load_validation_set(self.validation_file)
+        if val is None:
+            return
+        X, y = val
+        known = np.isin(y, np.asarray(model.classes_).astype(str))
+        if not known.any():
+            return
+        accuracy = float(np.mean(model.predict(model_features(model, X[known])) == y[known]))
+        if accuracy < self.min_accuracy:
+            raise ValueError(f"new model rejected, held-out accuracy {accuracy:.3f} < {self.min_accuracy}")
+
+    def watch(self, interval=MODEL_WATCH_INTERVAL, use_signal=True):
+        """
+        Start the background reload thread. It checks the model files every
+        'interval' seconds; with use_signal, SIGHUP (where the platform has it)
+        triggers a check right away, e.g. `kill -HUP <pid>` after training.
+        """
+        with self._lock:
+            if self._watcher is not None:
+                return
+            self._watcher = threading.Thread(target=self._watch, args=(interval,), name="hs-model-watcher", daemon=True)
+        self.refresh()
+        self._watcher.start()
+        if use_signal and hasattr(signal, "SIGHUP") and threading.current_thread() is threading.main_thread():
+            # only wake the watcher here: the handler runs on the main thread, which may hold the lock
+            signal.signal(signal.SIGHUP, lambda signum, frame: self._wake.set())
+
+    def _watch(self, interval):
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                self.refresh()
+            except Exception as e:
+                print("Model watcher error:", e)
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "loaded": self._model is not None,
+            "load_count": self.load_count,
+            "last_reload": self.last_reload,
+            "rejected": self.rejected,
+            "watching": self._watcher is not None,
+            "digest": self._digest,
+        }
+
+
+model_registry = ModelRegistry()
+
+
+class BatchPredictor:
+    """
+    Micro-batching front end for the resident classifier. Feature rows submitted
+    by concurrent requests are scored with a single predict_proba call; every
+    caller gets its own row back. Callers announce a frame with frame() before
+    its (slow) hand detection; a batch only waits, for up to 'window' seconds,
+    while announced frames may still add rows, so a lone frame is scored at
+    once. The worker thread starts on first use.
+    """
+
+    def __init__(self, registry=model_registry, window=BATCH_WINDOW, max_size=BATCH_MAX_SIZE):
+        self.registry = registry
+        self.window = window
+        self.max_size = max_size
+        self._cond = threading.Condition()
+        self._rows = deque()   # (features, future)
+        self._incoming = 0     # announced frames that haven't submitted a row yet
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.rows = 0
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="hs-batch-predictor", daemon=True)
+                self._thread.start()
+
+    @contextmanager
+    def frame(self):
+        """
+        Announce a frame whose row may follow; yields the ticket to pass to
+        predict_proba. Leaving the block without a row (no hand) withdraws it.
+        """
+        ticket = {"open": True}
+        with self._cond:
+            self._incoming += 1
+        try:
+            yield ticket
+        finally:
+            self._close_ticket(ticket)
+
+    def _close_ticket(self, ticket):
+        with self._cond:
+            if ticket["open"]:
+                ticket["open"] = False
+                self._incoming -= 1
+                self._cond.notify_all()
+
+    def predict_proba(self, features, timeout=BATCH_TIMEOUT, ticket=None):
+        """
+        Score one feature row. Returns (classes, probabilities) or None if no
+        model is loaded. The row is read when the batch runs, so the caller must
+        not modify it until this returns.
+        """
+        self._ensure_started()
+        future = Future()
+        with self._cond:
+            self._rows.append((features, future))
+            if ticket is not None and ticket["open"]:
+                ticket["open"] = False
+                self._incoming -= 1
+            self._cond.notify_all()
+        return future.result(timeout)
+
+    def predict(self, features, timeout=BATCH_TIMEOUT):
+        result = self.predict_proba(features, timeout)
+        if result is None:
+            return None
+        classes, proba = result
+        return classes[int(np.argmax(proba))]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._rows:
+                    self._cond.wait()
+                deadline = time.monotonic() + self.window
+                while len(self._rows) < self.max_size and self._incoming > 0:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = [self._rows.popleft() for _ in range(min(len(self._rows), self.max_size))]
+            self._score(batch)
+
+    def _score(self, batch):
+        futures = [f for _, f in batch]
+        try:
+            clf = self.registry.get()
+            if clf is None:
+                for f in futures:
+                    f.set_result(None)
+                return
+            X = np.asarray([row for row, _ in batch], dtype=np.float32)
+            proba = clf.predict_proba(model_features(clf, X))
+            classes = clf.classes_
+        except Exception as e:
+            for f in futures:
+                f.set_exception(e)
+            return
+        self.batches += 1
+        self.rows += len(batch)
+        for i, f in enumerate(futures):
+            f.set_result((classes, proba[i]))
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "rows": self.rows,
+            "avg_batch_size": (self.rows / self.batches) if self.batches else 0.0,
+            "queued": len(self._rows),
+            "incoming": self._incoming,
+        }
+
+
+batch_predictor = BatchPredictor()
+
+
+def predict_proba_from_frame(frame, clf=None, session_key=None):
+    """
+    Given a BGR frame (numpy) and an optional loaded classifier, returns
+    (classes, probabilities) for the frame, or None if no hands or no model.
+    Without an explicit classifier the row is scored through batch_predictor,
+    together with rows from other concurrent callers, on the resident model.
+    Pass session_key to reuse that session's hand tracker and feature buffer
+    across frames.
+    """
+    if clf is None and model_registry.get() is None:
+        return None
+
+    if clf is not None:
+        return _score_features(_frame_to_features(frame, session_key), clf)
+    # announced up front, so the batcher knows this frame's row may still arrive
+    with batch_predictor.frame() as ticket:
+        if session_key is None:
+            return _score_features(_frame_to_features(frame), ticket=ticket)
+        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        # the session's buffer is reused by its next frame, so keep it locked until the row is scored
+        with hands_pool.session(session_key) as entry:
+            features = extract_features(entry["hands"].process(rgb), entry["features"])
+            return _score_features(features, ticket=ticket)
+
+
+def predict_from_frame(frame, clf=None, session_key=None):
     """
     Given a BGR frame (numpy) and an optional loaded classifier,
     returns predicted word (string) or None if no hands or no model.
     """
-    if clf is None:
-        clf = load_model()
-    if clf is None:
+    scored = predict_proba_from_frame(frame, clf, session_key)
+    if scored is None:
         return None
+    classes, proba = scored
+    return str(classes[int(np.argmax(proba))])
+
 
-    features = _frame_to_features(frame)
+def _score_features(features, clf=None, ticket=None):
     if features is None:
         return None
     try:
-        pred = clf.predict([features])[0]
-        return str(pred)
+        if clf is None:
+            return batch_predictor.predict_proba(features, ticket=ticket)
+        return clf.classes_, clf.predict_proba(model_features(clf, features[None, :]))[0]
     except Exception as e:
         print("Prediction error:", e)
         return None
 
 
+# ---------------- Sign Decoding ----------------
+class SignDecoder:
+    """
+    Turns per-frame class probabilities into word events. Probabilities are
+    smoothed with an exponential moving average (alpha = weight of the newest
+    frame); a word is emitted once its smoothed probability reaches 'threshold'
+    and it has led for 'min_frames' frames in a row. A held sign is emitted
+    once: the same word can only fire again after another word has taken the
+    lead or the hand has been gone for 'release_frames' frames.
+    State round-trips through to_dict()/from_dict(), so it can live in a Flask
+    session between requests.
+    """
+
+    def __init__(self, alpha=DECODER_ALPHA, threshold=DECODER_THRESHOLD,
+                 min_frames=DECODER_MIN_FRAMES, release_frames=DECODER_RELEASE_FRAMES):
+        self.alpha = alpha
+        self.threshold = threshold
+        self.min_frames = min_frames
+        self.release_frames = release_frames
+        self.reset()
+
+    def reset(self):
+        self.classes = []
+        self.scores = None
+        self.leader = None
+        self.lead_frames = 0
+        self.latched = None
+        self.no_hand_frames = 0
+
+    @property
+    def confidence(self):
+        return 0.0 if self.scores is None else float(self.scores.max())
+
+    def update(self, classes=None, proba=None):
+        """
+        Feed one frame: the model's classes and this frame's probabilities, or
+        nothing for a frame without a hand. Returns the emitted word or None.
+        """
+        if proba is None:
+            self.no_hand_frames += 1
+            if self.no_hand_frames >= self.release_frames:
+                self.reset()
+            return None
+        self.no_hand_frames = 0
+
+        proba = np.asarray(proba, dtype=np.float64)
+        total = proba.sum()
+        if total > 0:
+            # masked or per-word models don't sum to 1
+            proba = proba / total
+        classes = [str(c) for c in classes]
+        if self.scores is None or classes != self.classes:
+            # first frame, or the model was swapped for one with other words
+            self.classes = classes
+            self.scores = proba
+            self.leader, self.lead_frames = None, 0
+        else:
+            self.scores = (1.0 - self.alpha) * self.scores + self.alpha * proba
+
+        best = int(np.argmax(self.scores))
+        word = self.classes[best]
+        if word == self.leader:
+            self.lead_frames += 1
+        else:
+            self.leader, self.lead_frames = word, 1
+            if word != self.latched:
+                self.latched = None
+        if word == self.latched:
+            return None
+        if self.scores[best] >= self.threshold and self.lead_frames >= self.min_frames:
+            self.latched = word
+            return word
+        return None
+
+    def to_dict(self):
+        return {
+            "classes": self.classes,
+            "scores": None if self.scores is None else [round(float(v), 4) for v in self.scores],
+            "leader": self.leader,
+            "lead_frames": self.lead_frames,
+            "latched": self.latched,
+            "no_hand_frames": self.no_hand_frames,
+        }
+
+    @classmethod
+    def from_dict(cls, data, **kwargs):
+        decoder = cls(**kwargs)
+        if data:
+            decoder.classes = list(data.get("classes") or [])
+            scores = data.get("scores")
+            decoder.scores = None if scores is None else np.asarray(scores, dtype=np.float64)
+            decoder.leader = data.get("leader")
+            decoder.lead_frames = data.get("lead_frames", 0)
+            decoder.latched = data.get("latched")
+            decoder.no_hand_frames = data.get("no_hand_frames", 0)
+        return decoder
+
+
+def append_to_sentence(sentence: str, word: str) -> str:
+    """
+    Add a decoded word to the sentence being signed: punctuation attaches to
+    the previous word, the first word of a sentence is capitalised, and a word
+    repeating the previous one is ignored.
+    """
+    if word in PUNCTUATION:
+        return sentence.strip() + word + " "
+    words = sentence.strip().split()
+    if words and words[-1].lower() == word.lower():
+        return sentence
+    if not words or words[-1][-1] in ".?!":
+        word = word.capitalize()
+    else:
+        word = word.lower()
+    return (sentence.strip() + " " + word).strip() + " "
+
+
 # ---------------- MODE: Delete Word ----------------
+def _drop_word_from_served_model(word):
+    # immediate effect for the web server: rewrite the flat model without the word's class
+    with _training_lock:
+        if not os.path.exists(FLAT_MODEL_FILE):
+            return
+        flat = FlatForest.load(FLAT_MODEL_FILE)
+        if word in flat.classes_:
+            flat.without_classes([word]).save(FLAT_MODEL_FILE)
+            print(f"'{word}' removed from the served model.")
+
+
+def _rebuild_after_delete():
+    # runs on a background thread so the CLI is free while the dataset is compacted and the model retrained
+    with _training_lock:
+        dropped = sample_store.compact()
+        if sample_store.live_rows() == 0:
+            return
+        print(f"\n[background] Dataset compacted ({dropped} rows dropped), retraining model...")
+        # per-word models only need the deleted word's model dropped
+        train_model(incremental=isinstance(load_model(), WordModelSet))
+        print("[background] Retraining after deletion finished.")
+
+
 def delete_word(word: str):
     """
-    Delete all entries of 'word' from the CSV and its reference image.
-    Retrains model automatically if data remains.
+    Delete all entries of 'word' from the dataset and its reference image.
+    The word is tombstoned in the dataset index and dropped from the served
+    model right away; compaction and the full retrain run in the background.
     """
-    if not os.path.exists(DATA_FILE):
-        print("No data found! CSV does not exist.")
+    _ensure_dataset()
+    if sample_store.live_rows() == 0:
+        print("No data found! Dataset is empty.")
         return
 
     word = word.strip().upper()
@@ -242,16 +1505,11 @@ def delete_word(word: str):
         print("Invalid word! Only alphabets allowed.")
         return
 
-    df = pd.read_csv(DATA_FILE, header=None)
-    initial_count = len(df)
-    df = df[df.iloc[:, -1].str.upper() != word]  # remove rows matching word
-    final_count = len(df)
-
-    if final_count < initial_count:
-        df.to_csv(DATA_FILE, index=False, header=False)
-        print(f"Deleted all entries of '{word}' from CSV.")
+    deleted = sample_store.delete_word(word)
+    if deleted:
+        print(f"Deleted all entries of '{word}' from the dataset.")
     else:
-        print(f"No entries found for '{word}' in CSV.")
+        print(f"No entries found for '{word}' in the dataset.")
 
     ref_path = os.path.join(REF_DIR, f"{word}.jpg")
     if os.path.exists(ref_path):
@@ -260,19 +1518,25 @@ def delete_word(word: str):
     else:
         print(f"No reference photo found for '{word}'.")
 
+    if not deleted:
+        return
     # Retrain or delete model
-    if os.path.exists(DATA_FILE) and os.path.getsize(DATA_FILE) > 0:
-        print("Retraining model after deletion...")
-        train_model()
+    if sample_store.live_rows() > 0:
+        _drop_word_from_served_model(word)
+        print("Retraining model in the background...")
+        # non-daemon: exiting the CLI waits for the retrain to finish
+        threading.Thread(target=_rebuild_after_delete, name="hs-rebuild").start()
     else:
-        if os.path.exists(MODEL_FILE):
-            os.remove(MODEL_FILE)
-        print("No data left in CSV. Model deleted.")
+        with _training_lock:
+            for path in (FLAT_MODEL_FILE, MODEL_FILE):
+                if os.path.exists(path):
+                    os.remove(path)
+        print("No data left in the dataset. Model deleted.")
 
 
 # ---------------- MODE: Show Trained Words ----------------
 def show_trained_words():
-    clf = load_model()
+    clf = model_registry.get()
     if clf is None:
         print("No trained model found! Train data first.")
         return
@@ -292,10 +1556,14 @@ def run_cli():
     while True:
         print("\nHS Module — Choose mode:")
         print("1: Collect Data")
-        print("2: Train Model")
+        print("2: Train Model (full, all cores)")
         print("3: Live Prediction (OpenCV window)")
         print("4: Delete Word")
         print("5: Show Trained Words")
+        print("6: Export Flat Model (for models trained before word_model.npz)")
+        print("7: Export Dataset to CSV")
+        print("8: Train Model (incremental, per-word models)")
+        print("9: Benchmark Feature Modes")
         print("0: Exit")
         mode = input("Enter mode: ").strip()
         if mode == "1":
@@ -309,6 +1577,15 @@ def run_cli():
             delete_word(w)
         elif mode == "5":
             show_trained_words()
+        elif mode == "6":
+            export_flat_model()
+        elif mode == "7":
+            _ensure_dataset()
+            sample_store.export_csv(DATA_FILE)
+        elif mode == "8":
+            train_model(incremental=True)
+        elif mode == "9":
+            benchmark_features()
         elif mode == "0":
             break
         else:
@@ -320,23 +1597,16 @@ def live_prediction():
     Run the interactive live_prediction OpenCV window (original behavior).
     This is kept for CLI usability.
     """
-    clf = load_model()
+    clf = model_registry.get()
     if clf is None:
         print("No trained model found! Train data first.")
         return
 
     cap = cv2.VideoCapture(0)
     sentence = ""
-    last_pred = None
-    pred_frame_count = 0
-    stable_frames_required = 5
-    no_hand_frames = 0
-    no_hand_threshold = 10
-    capitalize_next = True
-    used_words = set()
-    key_delay = 0.3
-    key_cooldowns = {"space": 0, "backspace": 0, ".": 0, ",": 0, "?": 0, "!": 0}
+    decoder = SignDecoder()
 
+    features = new_feature_buffer()
     with mp_hands.Hands(max_num_hands=2, min_detection_confidence=0.7) as hands:
         while True:
             ret, frame = cap.read()
@@ -344,54 +1614,24 @@ def live_prediction():
                 break
             rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             results = hands.process(rgb)
-            current_time = time.time()
 
-            if results.multi_hand_landmarks:
-                no_hand_frames = 0
-                data_row = []
-                hand1 = results.multi_hand_landmarks[0]
-                for lm in hand1.landmark:
-                    data_row.extend([lm.x, lm.y, lm.z])
-                if len(results.multi_hand_landmarks) > 1:
-                    hand2 = results.multi_hand_landmarks[1]
-                    for lm in hand2.landmark:
-                        data_row.extend([lm.x, lm.y, lm.z])
-                else:
-                    data_row.extend([0] * FEATURES_PER_HAND)
-
-                pred_word = clf.predict([data_row])[0]
-
-                if pred_word == last_pred:
-                    pred_frame_count += 1
-                else:
-                    pred_frame_count = 1
-                    last_pred = pred_word
-
-                if pred_frame_count >= stable_frames_required:
-                    if pred_word not in [".", ",", "?", "!"]:
-                        if pred_word.lower() not in used_words:
-                            formatted_word = pred_word.capitalize() if capitalize_next else pred_word.lower()
-                            sentence += formatted_word + " "
-                            used_words.add(pred_word.lower())
-                            capitalize_next = False
-                    else:
-                        sentence = sentence.strip() + pred_word + " "
-                        used_words.clear()
-                        capitalize_next = True
-
-                    pred_frame_count = 0
-                    last_pred = None
+            data_row = extract_features(results, features)
+            if data_row is not None:
+                proba = clf.predict_proba(model_features(clf, data_row[None, :]))[0]
+                word = decoder.update(clf.classes_, proba)
+                if word is not None:
+                    sentence = append_to_sentence(sentence, word)
 
                 for hand_landmarks in results.multi_hand_landmarks:
                     mp_draw.draw_landmarks(frame, hand_landmarks, mp_hands.HAND_CONNECTIONS)
             else:
-                no_hand_frames += 1
-                if no_hand_frames >= no_hand_threshold:
-                    last_pred = None
-                    pred_frame_count = 0
+                decoder.update()
 
             # keyboard handling intentionally omitted for simplicity in modular CLI
 
+            if decoder.leader is not None:
+                cv2.putText(frame, f"{decoder.leader} ({decoder.confidence:.2f})", (10, 30),
+                            cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 2)
             cv2.putText(frame, f"Sentence: {sentence}", (10, 450),
                         cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
             cv2.imshow("Live Prediction", frame)
@@ -403,4 +1643,6 @@ def live_prediction():
 
 # If run directly, run the CLI
 if __name__ == "__main__":
-    run_cli()
+    # go through the importable module so pickled models reference hs_module.WordModelSet, not __main__
+    import hs_module
+    hs_module.run_cli()
@@ -1,46 +1,239 @@
 import os
 import io
 import base64
+import json
+import time
+import struct
+import queue
+import asyncio
+import itertools
 import threading
-from flask import Flask, render_template_string, request, jsonify, session, redirect, url_for, send_file
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from flask import Flask, Response, render_template_string, request, jsonify, session, redirect, url_for, send_file
+try:
+    # optional: enables the /ws/hand streaming channel; the page falls back to HTTP polling without it
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
 import cv2
 import numpy as np
-import pyttsx3
-from fer import FER
 import hs_module as hs
+import tts_module as tts
+import emotion_module as emo
+import session_module as ss
 
 # ---------------- Groq API Client ----------------
 # Make sure to set your API key here directly
-from groq import Groq
-chatbot_api = Groq(api_key="insert your groq api key")
-
-def groq_chatbot_reply(user_input, sentiment="neutral"):
+from groq import Groq, AsyncGroq
+GROQ_API_KEY = "insert your groq api key"
+GROQ_BASE_URL = None   # None = Groq's default; point at a local fake completion server for testing
+GROQ_MODEL = "llama-3.3-70b-versatile"
+GROQ_ERROR_REPLY = "(I'm sorry, I couldn't connect right now.)"
+chatbot_api = Groq(api_key=GROQ_API_KEY, base_url=GROQ_BASE_URL)
+
+def _chat_messages(user_input, sentiment):
     system_message = f"""
     You are a compassionate mental health support assistant.
     The user currently looks {sentiment}.
     Please consider this emotional state when replying.
     """
+    return [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": user_input}
+    ]
+
+def groq_chatbot_reply(user_input, sentiment="neutral"):
     try:
         response = chatbot_api.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_input}
-            ],
+            model=GROQ_MODEL,
+            messages=_chat_messages(user_input, sentiment),
             temperature=0.7,
             max_tokens=200
         )
         return response.choices[0].message.content.strip()
     except Exception as e:
         print("Groq error:", e)
-        return "(I'm sorry, I couldn't connect right now.)"
+        return GROQ_ERROR_REPLY
+
+class GroqStreamer:
+    """
+    One AsyncGroq client, with its pooled HTTP connections, living on a
+    background event loop. stream_reply() runs a streamed completion on that
+    loop and yields the reply tokens to the calling Flask thread as they arrive.
+    """
+
+    def __init__(self, api_key=GROQ_API_KEY, base_url=GROQ_BASE_URL, timeout=60.0):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout
+        self._client = None
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name="groq-stream-loop", daemon=True).start()
+
+    async def _produce(self, messages, out):
+        try:
+            if self._client is None:
+                self._client = AsyncGroq(api_key=self.api_key, base_url=self.base_url)
+            stream = await self._client.chat.completions.create(
+                model=GROQ_MODEL,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=200,
+                stream=True
+            )
+            # closes the response (and frees its pooled connection) on completion, error or cancel()
+            async with stream:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        out.put(chunk.choices[0].delta.content)
+        except Exception as e:
+            print("Groq stream error:", e)
+            out.put(e)
+        finally:
+            out.put(None)
+
+    def stream_reply(self, user_input, sentiment="neutral", on_complete=None):
+        """
+        Yield reply tokens as they arrive. on_complete(full_text) is called only
+        if the whole reply streamed without error.
+        """
+        out = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(self._produce(_chat_messages(user_input, sentiment), out), self._loop)
+        parts = []
+        try:
+            while True:
+                try:
+                    item = out.get(timeout=self.timeout)
+                except queue.Empty:
+                    print("Groq stream error: no token within", self.timeout, "seconds")
+                    item = TimeoutError()
+                if item is None:
+                    if on_complete is not None:
+                        on_complete("".join(parts).strip())
+                    break
+                if isinstance(item, Exception):
+                    if not parts:
+                        yield GROQ_ERROR_REPLY
+                    break
+                parts.append(item)
+                yield item
+        finally:
+            # client went away or the stream ended: stop the upstream request
+            future.cancel()
+
+groq_streamer = GroqStreamer()
+
+# ---------------- Reply Cache ----------------
+REPLY_CACHE_SIZE = 256
+REPLY_CACHE_TTL = 6 * 60 * 60   # seconds
+REPLY_CACHE_FILE = None         # e.g. "reply_cache.json" to keep cached replies across restarts
+
+class ReplyCache:
+    """
+    Bounded LRU cache of chatbot replies keyed by (normalised input, sentiment).
+    Entries expire after 'ttl' seconds. With a 'path' the cache is loaded at
+    startup and rewritten (atomically) whenever a new reply is stored.
+    """
+
+    def __init__(self, max_size=REPLY_CACHE_SIZE, ttl=REPLY_CACHE_TTL, path=REPLY_CACHE_FILE):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> {"reply", "time", "hits"}
+        self.hits = 0
+        self.misses = 0
+        if path and os.path.exists(path):
+            self._load()
+
+    @staticmethod
+    def key(text, sentiment):
+        normalized = " ".join(text.lower().split()).strip(" .,!?")
+        return f"{sentiment}|{normalized}"
+
+    def get(self, text, sentiment):
+        key = self.key(text, sentiment)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry["time"] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            entry["hits"] += 1
+            self.hits += 1
+            return entry["reply"]
+
+    def put(self, text, sentiment, reply):
+        key = self.key(text, sentiment)
+        with self._lock:
+            self._entries[key] = {"reply": reply, "time": time.time(), "hits": 0}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            if self.path:
+                self._save()
+
+    def popular(self, n=10):
+        """
+        The n most frequently served cached replies.
+        """
+        with self._lock:
+            entries = sorted(self._entries.values(), key=lambda e: e["hits"], reverse=True)
+        return [e["reply"] for e in entries[:n]]
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print("Reply cache load error:", e)
+            return
+        now = time.time()
+        for key, entry in data.items():
+            if now - entry["time"] <= self.ttl:
+                self._entries[key] = entry
+
+    def _save(self):
+        tmp_file = self.path + ".tmp"
+        try:
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_file, self.path)
+        except OSError as e:
+            print("Reply cache save error:", e)
+
+reply_cache = ReplyCache()
+
+def cached_chatbot_reply(user_input, sentiment="neutral"):
+    reply = reply_cache.get(user_input, sentiment)
+    if reply is None:
+        reply = groq_chatbot_reply(user_input, sentiment)
+        if reply != GROQ_ERROR_REPLY:
+            reply_cache.put(user_input, sentiment, reply)
+    return reply
+
+def stream_cached_reply(user_input, sentiment="neutral"):
+    reply = reply_cache.get(user_input, sentiment)
+    if reply is not None:
+        return iter([reply])
+    def store(text):
+        if text:
+            reply_cache.put(user_input, sentiment, text)
+    return groq_streamer.stream_reply(user_input, sentiment, on_complete=store)
 
 # ---------------- Flask App ----------------
 app = Flask(__name__)
 app.secret_key = "supersecretkey"
-
-# Initialize FER detector once
-emotion_detector = FER(mtcnn=True)
+sock = Sock(app) if Sock is not None else None
 
 
 # ===== HTML Templates =====
@@ -326,26 +519,54 @@ const video = document.getElementById('camera');
 const emotionSpan = document.getElementById('emotion');
 navigator.mediaDevices.getUserMedia({video:true}).then(stream => { video.srcObject = stream; }).catch(err => alert('Camera error:'+err.message));
 
+// capture size and polling delay follow the server's hints
+let captureWidth = 320;
 async function pollEmotion(){
+  let delay = 500;
   const canvas = document.getElementById('hiddenCanvas');
-  canvas.width = video.videoWidth || 640;
-  canvas.height = video.videoHeight || 480;
+  const scale = Math.min(1, captureWidth / (video.videoWidth || 640));
+  canvas.width = Math.round((video.videoWidth || 640) * scale);
+  canvas.height = Math.round((video.videoHeight || 480) * scale);
   const ctx = canvas.getContext('2d');
   ctx.drawImage(video,0,0,canvas.width,canvas.height);
-  const dataUrl = canvas.toDataURL('image/jpeg',0.6);
   try {
-    const resp = await fetch('/api/emotion_detect',{
+    const blob = await new Promise(resolve => canvas.toBlob(resolve,'image/jpeg',0.6));
+    const resp = await fetch('/api/emotion_detect_frame',{
       method:'POST',
-      headers:{'Content-Type':'application/json'},
-      body: JSON.stringify({image:dataUrl})
+      headers:{'Content-Type':'image/jpeg'},
+      body: blob
     });
     const data = await resp.json();
     if(data.emotion) emotionSpan.innerText = data.emotion;
+    // the server asks for fewer frames while the emotion is stable or no face is in view
+    if(data.next_interval_ms) delay = data.next_interval_ms;
+    if(data.capture_width) captureWidth = data.capture_width;
   } catch(e){ console.error(e); }
-  setTimeout(pollEmotion, 500);
+  setTimeout(pollEmotion, delay);
 }
 video.addEventListener('playing', pollEmotion);
 
+// Read a server-sent-events reply, calling onText with the text received so far
+async function streamReply(url, payload, onText){
+  const resp = await fetch(url,{method:"POST", headers:{"Content-Type":"application/json"}, body:JSON.stringify(payload)});
+  const reader = resp.body.getReader();
+  const decoder = new TextDecoder();
+  let buf = '', text = '';
+  while(true){
+    const {value, done} = await reader.read();
+    if(done) break;
+    buf += decoder.decode(value, {stream:true});
+    let i;
+    while((i = buf.indexOf('\\n\\n')) >= 0){
+      const ev = buf.slice(0, i); buf = buf.slice(i + 2);
+      if(!ev.startsWith('data: ')) continue;
+      const msg = JSON.parse(ev.slice(6));
+      if(msg.token){ text += msg.token; onText(text); }
+    }
+  }
+  return text.trim();
+}
+
 // Chat send
 async function sendMessage(){
   const input = document.getElementById('user-input');
@@ -354,17 +575,52 @@ async function sendMessage(){
   chatBox.innerHTML += `<div class='message user'><b>You:</b> ${message}</div>`;
   input.value='';
   try {
-    const resp = await fetch("/api/chat",{method:"POST", headers:{"Content-Type":"application/json"}, body:JSON.stringify({message})});
-    const data = await resp.json();
-    chatBox.innerHTML += `<div class='message bot'><b>Bot:</b> ${data.reply}</div>`;
-    chatBox.scrollTop = chatBox.scrollHeight;
-    // TTS
-    const ttsResp = await fetch("/api/tts",{method:"POST", headers:{"Content-Type":"application/json"}, body:JSON.stringify({text:data.reply})});
-    const ttsBlob = await ttsResp.blob();
-    const audioUrl = URL.createObjectURL(ttsBlob);
-    const audio = new Audio(audioUrl); audio.play();
+    const botDiv = document.createElement('div');
+    botDiv.className = 'message bot';
+    botDiv.innerHTML = '<b>Bot:</b> ';
+    const botText = document.createElement('span');
+    botDiv.appendChild(botText);
+    chatBox.appendChild(botDiv);
+    const reply = await streamReply("/api/chat_stream", {message}, text => {
+      botText.innerText = text;
+      chatBox.scrollTop = chatBox.scrollHeight;
+    });
+    // TTS, streamed sentence by sentence
+    await speakStream(reply);
   } catch(e){ console.error(e); }
 }
+
+// Play length-prefixed audio clips from /api/tts_stream in order, starting with the first one to arrive
+async function speakStream(text){
+  const resp = await fetch("/api/tts_stream",{method:"POST", headers:{"Content-Type":"application/json"}, body:JSON.stringify({text})});
+  if(!resp.ok) return;
+  const reader = resp.body.getReader();
+  const clips = [];
+  let playing = false;
+  function playNext(){
+    if(!clips.length){ playing = false; return; }
+    playing = true;
+    const url = URL.createObjectURL(clips.shift());
+    const audio = new Audio(url);
+    audio.onended = () => { URL.revokeObjectURL(url); playNext(); };
+    audio.onerror = audio.onended;
+    audio.play().catch(() => playNext());
+  }
+  let buf = new Uint8Array(0);
+  while(true){
+    const {value, done} = await reader.read();
+    if(done) break;
+    const merged = new Uint8Array(buf.length + value.length);
+    merged.set(buf); merged.set(value, buf.length); buf = merged;
+    while(buf.length >= 4){
+      const len = new DataView(buf.buffer, buf.byteOffset, 4).getUint32(0);
+      if(buf.length < 4 + len) break;
+      clips.push(new Blob([buf.slice(4, 4 + len)], {type:'audio/mpeg'}));
+      buf = buf.slice(4 + len);
+      if(!playing) playNext();
+    }
+  }
+}
 </script>
 </body>
 </html>
@@ -457,38 +713,98 @@ navigator.mediaDevices.getUserMedia({video:true}).then(stream=>{video.srcObject=
 let sentence=sessionStorage.getItem('hand_sentence')||"";
 sentenceBox.innerText=sentence;
 let polling=true;
-async function pollFrame(){
-  if(!polling) return;
+// capture size and frame rate follow the server's hints (slower while no hand is in view)
+let captureWidth=320;
+let frameDelay=350;
+function captureBlob(){
   const canvas=document.getElementById('hiddenCanvas');
-  canvas.width=video.videoWidth||640;
-  canvas.height=video.videoHeight||480;
+  const scale=Math.min(1,captureWidth/(video.videoWidth||640));
+  canvas.width=Math.round((video.videoWidth||640)*scale);
+  canvas.height=Math.round((video.videoHeight||480)*scale);
   const ctx=canvas.getContext('2d');
   ctx.drawImage(video,0,0,canvas.width,canvas.height);
-  const dataUrl=canvas.toDataURL('image/jpeg',0.6);
+  return new Promise(resolve=>canvas.toBlob(resolve,'image/jpeg',0.6));
+}
+function handleHandResult(data){
+  if(data.next_interval_ms) frameDelay=data.next_interval_ms;
+  if(data.capture_width) captureWidth=data.capture_width;
+  if(data.skipped) return;
+  if(data.predicted){
+    detectedSpan.innerText=data.predicted;
+    if(data.appended){sentence=data.sentence; sentenceBox.innerText=sentence; sessionStorage.setItem('hand_sentence',sentence);}
+  } else { detectedSpan.innerText='—'; }
+}
+async function pollFrame(){
+  if(!polling) return;
   try{
-    const resp=await fetch('/api/hand_predict',{method:'POST', headers:{'Content-Type':'application/json'}, body:JSON.stringify({image:dataUrl})});
-    const data=await resp.json();
-    if(data.predicted){
-      detectedSpan.innerText=data.predicted;
-      if(data.appended){sentence=data.sentence; sentenceBox.innerText=sentence; sessionStorage.setItem('hand_sentence',sentence);}
-    } else { detectedSpan.innerText='—'; }
+    const blob=await captureBlob();
+    const resp=await fetch('/api/hand_predict_frame',{method:'POST', headers:{'Content-Type':'image/jpeg'}, body:blob});
+    handleHandResult(await resp.json());
   } catch(e){console.error(e);}
-  setTimeout(pollFrame,350);
+  setTimeout(pollFrame,frameDelay);
+}
+
+// Streaming channel: push frames over a WebSocket, at most 2 in flight; the server drops stale ones.
+// Falls back to HTTP polling if the server has no /ws/hand endpoint.
+let handSocket=null;
+let inFlight=0;
+function startStream(){
+  if(!('WebSocket' in window)) return pollFrame();
+  const proto=location.protocol==='https:'?'wss':'ws';
+  const socket=new WebSocket(`${proto}://${location.host}/ws/hand`);
+  let opened=false;
+  socket.onopen=()=>{opened=true; handSocket=socket; inFlight=0; frameDelay=100; streamFrame();};
+  socket.onmessage=ev=>{inFlight=Math.max(0,inFlight-1); handleHandResult(JSON.parse(ev.data));};
+  socket.onclose=()=>{handSocket=null; if(opened) setTimeout(startStream,1000); else pollFrame();};
+}
+async function streamFrame(){
+  if(!handSocket) return;
+  if(inFlight<2 && handSocket.bufferedAmount===0){
+    try{
+      const blob=await captureBlob();
+      if(handSocket){handSocket.send(blob); inFlight++;}
+    } catch(e){console.error(e);}
+  }
+  setTimeout(streamFrame,frameDelay);
+}
+function resetStream(){ if(handSocket) handSocket.send(JSON.stringify({type:'reset'})); }
+video.addEventListener('playing',()=>{startStream();});
+
+// Read a server-sent-events reply, calling onText with the text received so far
+async function streamReply(url,payload,onText){
+  const resp=await fetch(url,{method:'POST', headers:{'Content-Type':'application/json'}, body:JSON.stringify(payload)});
+  const reader=resp.body.getReader();
+  const decoder=new TextDecoder();
+  let buf='', text='';
+  while(true){
+    const {value,done}=await reader.read();
+    if(done) break;
+    buf+=decoder.decode(value,{stream:true});
+    let i;
+    while((i=buf.indexOf('\\n\\n'))>=0){
+      const ev=buf.slice(0,i); buf=buf.slice(i+2);
+      if(!ev.startsWith('data: ')) continue;
+      const msg=JSON.parse(ev.slice(6));
+      if(msg.token){text+=msg.token; onText(text);}
+    }
+  }
+  return text.trim();
 }
-video.addEventListener('playing',()=>{pollFrame();});
 
 // Enter/send
 document.getElementById('enterBtn').addEventListener('click',async ()=>{
   const s=sentence; if(!s.trim()) return alert('No sentence to send.');
-  const resp=await fetch('/api/hand_enter',{method:'POST', headers:{'Content-Type':'application/json'}, body:JSON.stringify({sentence:s})});
-  const data=await resp.json();
-  replyBox.innerText=data.reply;
-  sentence=''; sentenceBox.innerText=''; sessionStorage.removeItem('hand_sentence');
+  sentence=''; sentenceBox.innerText=''; sessionStorage.removeItem('hand_sentence'); resetStream();
+  replyBox.innerText='';
+  try{
+    await streamReply('/api/hand_enter_stream',{sentence:s},text=>{replyBox.innerText=text;});
+  } catch(e){console.error(e);}
 });
 
 // Reset
 document.getElementById('resetBtn').addEventListener('click',async ()=>{
   await fetch('/api/hand_reset',{method:'POST'});
+  resetStream();
   sentence=''; sentenceBox.innerText=''; sessionStorage.removeItem('hand_sentence'); detectedSpan.innerText='—';
 });
 </script>
@@ -609,6 +925,150 @@ if (localStorage.getItem('dark-mode') === 'true') {
 </body>
 </html>
 """
+# ---------------- Session helpers ----------------
+def _session_id():
+    # stable per-browser id used to key server-side per-user state (hand trackers etc.)
+    sid = session.get("sid")
+    if sid is None:
+        sid = uuid.uuid4().hex
+        session["sid"] = sid
+    return sid
+
+@contextmanager
+def _user_state(name):
+    """
+    The current user's server-side state 'name' (a dict in ss.session_store,
+    not in the cookie). Changes are saved when the with block ends.
+    """
+    sid = _session_id()
+    state = ss.session_store.get(sid, name)
+    yield state
+    ss.session_store.save(sid, name, state)
+
+def _sentiment():
+    # leading emotion of the user's camera feed, for the chatbot prompt
+    return ss.session_store.get(_session_id(), "emotion").get("sentiment", "neutral")
+
+# ---------------- Frame upload helpers ----------------
+MAX_FRAME_BYTES = 4 * 1024 * 1024
+
+def _read_frame_bytes():
+    """
+    Return the uploaded camera frame as an encoded (JPEG/PNG) uint8 numpy buffer,
+    or None. Accepts a raw image body (Content-Type image/*), a multipart upload
+    in field 'frame', or the legacy JSON {"image": <data-URL>}.
+    Raw bodies are read straight from the request stream into the numpy buffer.
+    """
+    mimetype = request.mimetype or ""
+    if mimetype.startswith("image/") or mimetype == "application/octet-stream":
+        length = request.content_length
+        if not length or length > MAX_FRAME_BYTES:
+            return None
+        stream = request.stream
+        if not hasattr(stream, "readinto"):
+            return np.frombuffer(stream.read(length), np.uint8)
+        buf = np.empty(length, np.uint8)
+        view = memoryview(buf)
+        received = 0
+        while received < length:
+            n = stream.readinto(view[received:])
+            if not n:
+                return None
+            received += n
+        return buf
+    if mimetype == "multipart/form-data":
+        upload = request.files.get("frame")
+        if upload is None:
+            return None
+        raw = upload.read(MAX_FRAME_BYTES + 1)
+        if not raw or len(raw) > MAX_FRAME_BYTES:
+            return None
+        return np.frombuffer(raw, np.uint8)
+    data = (request.get_json(silent=True) or {}).get("image")
+    if not data:
+        return None
+    image_data = data.split(",")[1] if "," in data else data
+    return np.frombuffer(base64.b64decode(image_data), np.uint8)
+
+def _decode_frame(buf):
+    """
+    Decode an encoded image buffer into a BGR frame, or None if it is not an image.
+    """
+    if buf is None or buf.size == 0:
+        return None
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+
+# ---------------- Frame scheduling ----------------
+FRAME_WORKERS = 4          # frames processed at once per pipeline, across all users
+FRAME_WAIT_TIMEOUT = 1.0   # seconds a frame may wait for its turn before it is skipped
+
+class FrameScheduler:
+    """
+    "Latest frame wins" admission for camera frames, one slot per session.
+    While a frame from a session is being processed, only the newest waiting
+    frame from that session is kept; older waiters are skipped before they are
+    decoded. At most max_workers frames run at once across all sessions, and a
+    frame that cannot get a worker within wait_timeout is skipped too.
+    """
+
+    def __init__(self, max_workers=FRAME_WORKERS, wait_timeout=FRAME_WAIT_TIMEOUT):
+        self.wait_timeout = wait_timeout
+        self._cond = threading.Condition()
+        self._slots = {}  # key -> {"busy", "latest", "waiters"}
+        self._tickets = itertools.count()
+        self._workers = threading.BoundedSemaphore(max_workers)
+        self.processed = 0
+        self.skipped = 0
+
+    @contextmanager
+    def admit(self, key):
+        """
+        Context manager yielding True if this frame should be processed now,
+        False if it was superseded by a newer frame or the pipeline is saturated.
+        """
+        ticket = next(self._tickets)
+        deadline = time.monotonic() + self.wait_timeout
+        with self._cond:
+            slot = self._slots.setdefault(key, {"busy": False, "latest": None, "waiters": 0})
+            slot["latest"] = ticket
+            slot["waiters"] += 1
+            self._cond.notify_all()
+            while slot["busy"] and slot["latest"] == ticket:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            admitted = not slot["busy"] and slot["latest"] == ticket
+            if admitted:
+                slot["busy"] = True
+        has_worker = admitted and self._workers.acquire(timeout=max(0.0, deadline - time.monotonic()))
+        try:
+            with self._cond:
+                if has_worker:
+                    self.processed += 1
+                else:
+                    self.skipped += 1
+            yield has_worker
+        finally:
+            if has_worker:
+                self._workers.release()
+            with self._cond:
+                if admitted:
+                    slot["busy"] = False
+                slot["waiters"] -= 1
+                if slot["waiters"] == 0 and self._slots.get(key) is slot:
+                    del self._slots[key]
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {"processed": self.processed, "skipped": self.skipped, "active_sessions": len(self._slots)}
+
+hand_scheduler = FrameScheduler()
+# at most FRAME_WORKERS hand frames are in flight, so no batch can hold more rows than that
+hs.batch_predictor.max_size = FRAME_WORKERS
+emotion_scheduler = FrameScheduler()
+
 # ---------------- Routes ----------------
 @app.route("/", methods=["GET", "POST"])
 def home():
@@ -616,6 +1076,7 @@ def home():
         session["name"] = request.form.get("name")
         session["email"] = request.form.get("email")
         session["phone"] = request.form.get("phone")
+        _session_id()
         return redirect(url_for("mode_select"))
     return render_template_string(login_html)
 
@@ -635,137 +1096,358 @@ def normal_chat():
 def hand_chat():
     if "name" not in session:
         return redirect(url_for("home"))
-    session.setdefault("hand_sentence", "")
     return render_template_string(hand_chat_html, name=session["name"])
 
 @app.route("/logout")
 def logout():
+    if "sid" in session:
+        hs.hands_pool.release(session["sid"])
+        ss.session_store.clear(session["sid"])
     session.clear()
     return redirect(url_for("home"))
 
 # ---------------- Chat API ----------------
+BANNED_WORDS = ["sex","porn","kill","suicide","murder","violence","drugs","rape"]
+SAFETY_REPLY = "⚠️ I’m here to support your mental health safely. Please reach out to a trusted person or helpline if needed."
+
+def _is_banned(text):
+    return any(word in text.lower() for word in BANNED_WORDS)
+
 @app.route("/api/chat", methods=["POST"])
 def chat_api():
     user_input = request.json.get("message", "").strip()
-    sentiment = session.get("sentiment", "neutral")
-    banned_words = ["sex","porn","kill","suicide","murder","violence","drugs","rape"]
-    if any(word in user_input.lower() for word in banned_words):
-        return jsonify({"reply": "⚠️ I’m here to support your mental health safely. Please reach out to a trusted person or helpline if needed."})
-    ai_message = groq_chatbot_reply(user_input, sentiment)
+    sentiment = _sentiment()
+    if _is_banned(user_input):
+        return jsonify({"reply": SAFETY_REPLY})
+    ai_message = cached_chatbot_reply(user_input, sentiment)
     return jsonify({"reply": ai_message})
 
+def _sse_response(tokens):
+    # server-sent events: one {"token": ...} event per chunk, then {"done": true}
+    def events():
+        for token in tokens:
+            yield f"data: {json.dumps({'token': token})}\n\n"
+        yield f"data: {json.dumps({'done': True})}\n\n"
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/api/chat_stream", methods=["POST"])
+def chat_stream():
+    user_input = request.json.get("message", "").strip()
+    sentiment = _sentiment()
+    if _is_banned(user_input):
+        return _sse_response([SAFETY_REPLY])
+    return _sse_response(stream_cached_reply(user_input, sentiment))
+
+@app.route("/api/chat_cache", methods=["GET"])
+def chat_cache_status():
+    return jsonify(reply_cache.stats())
+
 # ---------------- TTS API ----------------
 @app.route("/api/tts", methods=["POST"])
 def tts_api():
     text = request.json.get("text", "")
-    engine = pyttsx3.init()
-    engine.setProperty('rate', 200)
-    audio_fp = io.BytesIO()
-    temp_file = "temp_tts.mp3"
-    engine.save_to_file(text, temp_file)
-    engine.runAndWait()
-    with open(temp_file, "rb") as f:
-        audio_fp.write(f.read())
-    audio_fp.seek(0)
-    os.remove(temp_file)
-    return send_file(audio_fp, mimetype="audio/mpeg")
+    try:
+        audio = tts.get_audio(text)
+    except tts.TTSBusyError:
+        return jsonify({"error": "Speech synthesis is busy, try again shortly."}), 503
+    except TimeoutError:
+        return jsonify({"error": "Speech synthesis timed out."}), 504
+    return send_file(io.BytesIO(audio), mimetype="audio/mpeg")
+
+@app.route("/api/tts_stream", methods=["POST"])
+def tts_stream():
+    # one frame per sentence: 4-byte big-endian length, then a complete audio clip
+    text = request.json.get("text", "")
+
+    def frames():
+        try:
+            for clip in tts.stream_audio(text):
+                yield struct.pack(">I", len(clip)) + clip
+        except (tts.TTSBusyError, TimeoutError) as e:
+            print("TTS stream error:", e)
+
+    return Response(frames(), mimetype="application/octet-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/api/tts_cache", methods=["GET"])
+def tts_cache_status():
+    stats = tts.audio_cache.stats()
+    stats["pool"] = tts.tts_pool.stats()
+    return jsonify(stats)
 
 # ---------------- Hand-sign APIs ----------------
 @app.route("/api/hand_predict", methods=["POST"])
+@app.route("/api/hand_predict_frame", methods=["POST"])
 def hand_predict():
-    data = request.json.get("image")
-    if not data:
-        return jsonify({"predicted": None, "appended": False, "sentence": session.get("hand_sentence","")})
-    try:
-        image_data = data.split(",")[1] if "," in data else data
-        img_bytes = base64.b64decode(image_data)
-        np_arr = np.frombuffer(img_bytes, np.uint8)
-        frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-    except:
-        return jsonify({"predicted": None, "appended": False, "sentence": session.get("hand_sentence","")})
-
-    clf = hs.load_model()
-    if clf is None:
-        return jsonify({"predicted": None, "appended": False, "sentence": session.get("hand_sentence","")})
-
-    pred = hs.predict_from_frame(frame, clf=clf)
-    if pred is None:
-        session['hand_last_pred'] = None
-        session['hand_pred_count'] = 0
-        return jsonify({"predicted": None, "appended": False, "sentence": session.get("hand_sentence","")})
-
-    last = session.get('hand_last_pred', None)
-    count = session.get('hand_pred_count', 0)
-    stable_required = 4
-    appended = False
-
-    if last == pred:
-        count += 1
-    else:
-        count = 1
-        last = pred
-    session['hand_last_pred'] = last
-    session['hand_pred_count'] = count
-
-    if count >= stable_required:
-        s = session.get("hand_sentence", "")
-        if pred in [".", ",", "?", "!"]:
-            s = s.strip() + pred + " "
-        else:
-            words = s.strip().split()
-            last_word = words[-1] if words else ""
-            if pred != last_word:
-                to_add = pred.capitalize() if s.strip()=="" else pred.lower()
-                s = (s + " " + to_add).strip() + " "
-        session['hand_sentence'] = s
-        appended = True
-        session['hand_pred_count'] = 0
-        session['hand_last_pred'] = None
-
-    return jsonify({"predicted": pred, "appended": appended, "sentence": session.get("hand_sentence","")})
+    sid = _session_id()
+    with hand_scheduler.admit(sid) as admitted:
+        if not admitted:
+            # read only: the frame being processed for this user saves the state
+            return _hand_response(ss.session_store.get(sid, "hand"), skipped=True)
+        with _user_state("hand") as state:
+            try:
+                frame = _decode_frame(_read_frame_bytes())
+            except:
+                frame = None
+            if frame is None:
+                return _hand_response(state)
+
+            if hs.model_registry.get() is None:
+                return _hand_response(state)
+
+            scored = hs.predict_proba_from_frame(frame, session_key=sid)
+            pred, appended = _advance_hand_state(state, scored)
+            return _hand_response(state, pred, appended)
+
+def _hand_response(state, pred=None, appended=False, skipped=False):
+    return jsonify({"predicted": pred, "appended": appended, "skipped": skipped,
+                    "sentence": state.get("hand_sentence", ""),
+                    **_capture_hints(state, HAND_INTERVAL_MS, skipped)})
+
+# ---------------- Capture hints ----------------
+# Every frame response tells the page when to send the next frame and how wide to capture it.
+HAND_INTERVAL_MS = 350         # HTTP polling while a hand is in view
+HAND_STREAM_INTERVAL_MS = 100  # WebSocket streaming while a hand is in view
+HAND_IDLE_FRAMES = 5           # frames without a hand before the page backs off
+HAND_IDLE_INTERVAL_MS = 1500   # slowest rate while nobody is signing
+HAND_CAPTURE_WIDTH = 320       # MediaPipe's palm detector works at 192 px; more is wasted upload
+EMOTION_CAPTURE_WIDTH = 320    # faces still cover well over HAAR_MIN_FACE; FER classifies 48 px crops
+
+def _capture_hints(state, base_ms, busy=False):
+    # doubles per empty frame after HAND_IDLE_FRAMES, and once more while the server is busy
+    idle = state.get('hand_idle', 0)
+    interval = base_ms
+    if idle >= HAND_IDLE_FRAMES:
+        interval = min(base_ms * 2 ** (idle - HAND_IDLE_FRAMES + 1), HAND_IDLE_INTERVAL_MS)
+    if busy:
+        interval = min(interval * 2, HAND_IDLE_INTERVAL_MS)
+    return {"next_interval_ms": interval, "capture_width": HAND_CAPTURE_WIDTH}
+
+def _advance_hand_state(state, scored):
+    """
+    Feed one frame's (classes, probabilities) (None = no hand) into the sign
+    decoder kept in 'state', the user's server-side "hand" state. Returns (leading word, appended), where
+    appended is True if a word was added to state['hand_sentence']. The leading word is None for a
+    frame without a hand.
+    """
+    decoder = hs.SignDecoder.from_dict(state.get('hand_decoder'))
+    word = decoder.update() if scored is None else decoder.update(*scored)
+    state['hand_idle'] = 0 if scored is not None else state.get('hand_idle', 0) + 1
+    state['hand_decoder'] = decoder.to_dict()
+    # the decoder keeps its leader for a few hand-less frames; the page shouldn't
+    leader = None if scored is None else decoder.leader
+    if word is None:
+        return leader, False
+    state['hand_sentence'] = hs.append_to_sentence(state.get("hand_sentence", ""), word)
+    return leader, True
+
+def _reset_hand_state(state):
+    state['hand_sentence'] = ""
+    state['hand_decoder'] = None
+    state['hand_idle'] = 0
+
+# ---------------- Hand-sign streaming (WebSocket) ----------------
+class _LatestFrameSlot:
+    """
+    Single-slot mailbox between a WebSocket reader thread and the processing loop.
+    A new frame replaces any frame that has not been picked up yet, so under
+    backpressure stale frames are dropped instead of queued. Dropped frames are
+    handed back by take() so the processing loop can answer them too.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._frame = None
+        self._reset = False
+        self._closed = False
+        self._unanswered = 0
+        self.dropped = 0
+
+    def put(self, frame):
+        with self._cond:
+            if self._frame is not None:
+                self.dropped += 1
+                self._unanswered += 1
+            self._frame = frame
+            self._cond.notify()
+
+    def request_reset(self):
+        with self._cond:
+            self._reset = True
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def take(self):
+        """
+        Block until a frame or reset is pending. Returns (frame, reset, dropped),
+        dropped being the number of frames replaced since the last call;
+        returns (None, False, 0) once the connection is closed.
+        """
+        with self._cond:
+            while self._frame is None and not self._reset and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                return None, False, 0
+            frame, reset, dropped = self._frame, self._reset, self._unanswered
+            self._frame, self._reset, self._unanswered = None, False, 0
+            return frame, reset, dropped
+
+def hand_stream(ws):
+    # Browser pushes binary JPEG frames and {"type": "reset"} text messages;
+    # server pushes one {"predicted", "appended", "sentence", "dropped", capture hints} event per processed frame
+    # and one {"skipped": true} event per frame dropped under backpressure.
+    sid = session.get("sid") or uuid.uuid4().hex
+    state = ss.session_store.get(sid, "hand")
+    state.update({"hand_decoder": None, "hand_idle": 0})
+    slot = _LatestFrameSlot()
+
+    def reader():
+        try:
+            while True:
+                msg = ws.receive()
+                if msg is None:
+                    continue
+                if isinstance(msg, (bytes, bytearray)):
+                    slot.put(msg)
+                else:
+                    try:
+                        msg_type = json.loads(msg).get("type")
+                    except (ValueError, AttributeError):
+                        msg_type = None
+                    if msg_type == "reset":
+                        slot.request_reset()
+        except Exception:
+            pass
+        finally:
+            slot.close()
+
+    threading.Thread(target=reader, daemon=True).start()
+    while True:
+        frame_bytes, reset, dropped = slot.take()
+        try:
+            # every frame the client sent gets a reply, so its in-flight count stays right
+            for _ in range(dropped):
+                ws.send(json.dumps({"skipped": True, "dropped": slot.dropped}))
+        except Exception:
+            break
+        if reset:
+            _reset_hand_state(state)
+            ss.session_store.save(sid, "hand", state)
+        if frame_bytes is None:
+            if reset:
+                continue
+            break
+        pred, appended = None, False
+        with hand_scheduler.admit(sid) as admitted:
+            if admitted:
+                frame = _decode_frame(np.frombuffer(frame_bytes, np.uint8))
+                scored = None
+                if frame is not None and hs.model_registry.get() is not None:
+                    scored = hs.predict_proba_from_frame(frame, session_key=sid)
+                pred, appended = _advance_hand_state(state, scored)
+                ss.session_store.save(sid, "hand", state)
+        try:
+            ws.send(json.dumps({"predicted": pred, "appended": appended, "skipped": not admitted,
+                                "sentence": state.get("hand_sentence", ""), "dropped": slot.dropped,
+                                **_capture_hints(state, HAND_STREAM_INTERVAL_MS, not admitted)}))
+        except Exception:
+            break
+    slot.close()
+
+if sock is not None:
+    sock.route("/ws/hand")(hand_stream)
+
+@app.route("/api/hand_model", methods=["GET"])
+def hand_model_status():
+    hs.model_registry.get()
+    stats = hs.model_registry.stats()
+    stats["batching"] = hs.batch_predictor.stats()
+    return jsonify(stats)
 
 @app.route("/api/hand_enter", methods=["POST"])
 def hand_enter():
     sent = request.json.get("sentence", "").strip()
     if not sent:
         return jsonify({"reply": "No sentence provided."})
-    reply = groq_chatbot_reply(sent, session.get("sentiment", "neutral"))
-    session['hand_sentence'] = ""
-    session['hand_last_pred'] = None
-    session['hand_pred_count'] = 0
+    reply = cached_chatbot_reply(sent, _sentiment())
+    with _user_state("hand") as state:
+        _reset_hand_state(state)
     return jsonify({"reply": reply})
 
+@app.route("/api/hand_enter_stream", methods=["POST"])
+def hand_enter_stream():
+    sent = request.json.get("sentence", "").strip()
+    if not sent:
+        return _sse_response(["No sentence provided."])
+    sentiment = _sentiment()
+    with _user_state("hand") as state:
+        _reset_hand_state(state)
+    return _sse_response(stream_cached_reply(sent, sentiment))
+
 @app.route("/api/hand_reset", methods=["POST"])
 def hand_reset():
-    session['hand_sentence'] = ""
-    session['hand_last_pred'] = None
-    session['hand_pred_count'] = 0
+    with _user_state("hand") as state:
+        _reset_hand_state(state)
     return jsonify({"ok": True})
 
 # ---------------- Emotion Detection ----------------
 @app.route("/api/emotion_detect", methods=["POST"])
+@app.route("/api/emotion_detect_frame", methods=["POST"])
 def emotion_detect():
-    data = request.json.get("image")
-    if not data:
-        return jsonify({"emotion": None})
-    try:
-        image_data = data.split(",")[1] if "," in data else data
-        img_bytes = base64.b64decode(image_data)
-        np_arr = np.frombuffer(img_bytes, np.uint8)
-        frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        emotions = emotion_detector.detect_emotions(frame_rgb)
-        if emotions:
-            top_emotion = max(emotions[0]["emotions"], key=emotions[0]["emotions"].get)
-            session['sentiment'] = top_emotion
-            return jsonify({"emotion": top_emotion})
-        return jsonify({"emotion": "neutral"})
-    except Exception as e:
-        print("Emotion detect error:", e)
-        return jsonify({"emotion": None})
+    sid = _session_id()
+    with emotion_scheduler.admit(sid) as admitted:
+        if not admitted:
+            state = emo.EmotionState.from_dict(ss.session_store.get(sid, "emotion").get("state"))
+            return _emotion_response(state, skipped=True)
+        with _user_state("emotion") as user:
+            # a decayed emotion score vector; its leading emotion is the chatbot's sentiment
+            state = emo.EmotionState.from_dict(user.get("state"))
+            try:
+                buf = _read_frame_bytes()
+                if buf is None or buf.size == 0:
+                    return _emotion_response(state)
+                # decoded and recognised in a worker process; the face box is tracked from frame to frame
+                emotions, user["face_track"] = emo.emotion_pool.analyse(buf, user.get("face_track"))
+                if emotions:
+                    state.update(emotions)
+                    user["state"] = state.to_dict()
+                    user["sentiment"] = state.sentiment
+                    return _emotion_response(state, emo.top_emotion(emotions))
+                state.miss()
+                user["state"] = state.to_dict()
+                return _emotion_response(state)
+            except (emo.EmotionBusyError, TimeoutError):
+                # saturated: answer without touching the state, and ask the client to slow down
+                return _emotion_response(state, busy=True)
+            except Exception as e:
+                print("Emotion detect error:", e)
+                return _emotion_response(state)
+
+def _emotion_response(state, frame_emotion=None, skipped=False, busy=False):
+    interval = state.interval_ms
+    if busy:
+        interval = min(interval * 2, emo.EMOTION_MAX_INTERVAL_MS)
+    return jsonify({"emotion": state.sentiment, "frame_emotion": frame_emotion,
+                    "confidence": round(state.confidence, 3), "skipped": skipped, "busy": busy,
+                    "next_interval_ms": interval, "capture_width": EMOTION_CAPTURE_WIDTH})
+
+@app.route("/api/frame_stats", methods=["GET"])
+def frame_stats():
+    return jsonify({"hand": hand_scheduler.stats(), "emotion": emotion_scheduler.stats(),
+                    "emotion_pool": emo.emotion_pool.stats(), "sessions": ss.session_store.stats()})
 
 # ---------------- Main ----------------
 def start_flask():
+    # replies we know will be spoken: the safety message, the error message and the most served cached replies
+    tts.presynthesize([SAFETY_REPLY, GROQ_ERROR_REPLY] + reply_cache.popular())
+    # pick up models trained from the CLI without restarting the server
+    hs.model_registry.watch()
+    emo.emotion_pool.start()
     app.run(debug=False, threaded=True)
 
 def start_cli_training():
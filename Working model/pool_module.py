@@ -0,0 +1,134 @@
+# pool_module.py
+# Bounded pool of worker processes shared by the speech (tts_module) and
+# emotion (emotion_module) services: each worker keeps its expensive engine or
+# model alive for its whole life, and callers are turned away instead of
+# queueing without limit when the pool is saturated.
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# per-process instances created by worker_resource
+_resources = {}
+
+
+def worker_resource(factory, *args):
+    """
+    This process's instance of factory(*args), created on first use. Used as
+    the pool initializer (so workers load it when they start) and by the jobs.
+    """
+    key = (factory, args)
+    resource = _resources.get(key)
+    if resource is None:
+        resource = _resources[key] = factory(*args)
+    return resource
+
+
+class PoolBusyError(RuntimeError):
+    pass
+
+
+class BoundedProcessPool:
+    """
+    Fixed pool of worker processes. At most max_queue jobs may be queued or
+    running; submitting more raises busy_error. Jobs submitted with the same
+    key while one is in flight share its Future. Workers start on first use
+    (or start()), running initializer(*initargs) once each, and the pool is
+    rebuilt if a worker process dies.
+    """
+
+    def __init__(self, workers, max_queue, timeout, initializer=None, initargs=(), busy_error=PoolBusyError):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.initializer = initializer
+        self.initargs = initargs
+        self.busy_error = busy_error
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = 0
+        self._inflight = {}  # key -> Future
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=self.initializer,
+                                                 initargs=self.initargs)
+        return self._executor
+
+    def start(self):
+        # start every worker now, so the initializer runs before the first real job
+        if self.workers > 0:
+            with self._lock:
+                executor = self._get_executor()
+            for _ in range(self.workers):
+                executor.submit(os.getpid)
+
+    def submit_job(self, fn, *args, key=None):
+        """
+        Queue fn(*args) and return its Future. Raises busy_error when the
+        queue is full.
+        """
+        with self._lock:
+            if key is not None:
+                future = self._inflight.get(key)
+                if future is not None:
+                    return future
+            if self._pending >= self.max_queue:
+                self.rejected += 1
+                raise self.busy_error("worker queue is full")
+            try:
+                future = self._get_executor().submit(fn, *args)
+            except BrokenProcessPool:
+                self._executor = None
+                future = self._get_executor().submit(fn, *args)
+            self._pending += 1
+            if key is not None:
+                self._inflight[key] = future
+        future.add_done_callback(lambda f: self._finished(key, f))
+        return future
+
+    def _finished(self, key, future):
+        with self._lock:
+            self._pending -= 1
+            if key is not None:
+                self._inflight.pop(key, None)
+            if future.exception() is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+                if isinstance(future.exception(), BrokenProcessPool):
+                    self._executor = None
+
+    def wait(self, future, timeout=None):
+        """
+        Result of a submitted job. Raises TimeoutError if it takes longer than
+        the timeout (the pool's by default).
+        """
+        try:
+            return future.result(self.timeout if timeout is None else timeout)
+        except TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_depth": self._pending,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,127 @@
+# session_module.py
+# Server-side per-user state (hand-sign decoding, emotion tracking) kept out of
+# Flask's signed cookie and keyed by the session id: an in-process store with
+# expiry by default, or Redis when several server processes share the users.
+
+import copy
+import json
+import time
+import threading
+try:
+    # optional: only needed when SESSION_STORE_URL points at Redis
+    import redis
+except ImportError:
+    redis = None
+
+# ---------------- SETTINGS ----------------
+SESSION_STORE_URL = None            # e.g. "redis://localhost:6379/0"; None = in-process memory
+SESSION_TTL = 30 * 60               # seconds of inactivity before a user's state is dropped
+SESSION_SWEEP_EVERY = 60            # seconds between expiry sweeps of the memory store
+SESSION_KEY_PREFIX = "mhc:session:"
+# ------------------------------------------
+
+
+class MemorySessionStore:
+    """
+    Per-session state in this process. Each session id holds named state
+    dicts (e.g. "hand", "emotion") that are read and written independently, so
+    concurrent requests updating different parts don't overwrite each other.
+    A session expires ttl seconds after it was last saved or read.
+    """
+
+    def __init__(self, ttl=SESSION_TTL, sweep_every=SESSION_SWEEP_EVERY):
+        self.ttl = ttl
+        self.sweep_every = sweep_every
+        self._lock = threading.Lock()
+        self._sessions = {}  # sid -> {"expires": t, "states": {name: dict}}
+        self._last_sweep = time.monotonic()
+        self.expired = 0
+
+    def _sweep(self, now):
+        if now - self._last_sweep < self.sweep_every:
+            return
+        self._last_sweep = now
+        for sid in [s for s, e in self._sessions.items() if e["expires"] <= now]:
+            del self._sessions[sid]
+            self.expired += 1
+
+    def get(self, sid, name):
+        """
+        Copy of the state 'name' of session 'sid' ({} if there is none yet).
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            entry = self._sessions.get(sid)
+            if entry is None or entry["expires"] <= now:
+                return {}
+            entry["expires"] = now + self.ttl
+            return copy.deepcopy(entry["states"].get(name, {}))
+
+    def save(self, sid, name, state):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None or entry["expires"] <= now:
+                entry = self._sessions[sid] = {"expires": now, "states": {}}
+            entry["states"][name] = copy.deepcopy(state)
+            entry["expires"] = now + self.ttl
+
+    def clear(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def stats(self):
+        with self._lock:
+            return {"backend": "memory", "sessions": len(self._sessions), "expired": self.expired, "ttl": self.ttl}
+
+
+class RedisSessionStore:
+    """
+    Same interface as MemorySessionStore, backed by Redis: one hash per session
+    id with a JSON value per state name, expiring ttl seconds after the last
+    write. Lets several server processes serve the same users.
+    """
+
+    def __init__(self, url, ttl=SESSION_TTL, prefix=SESSION_KEY_PREFIX):
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, sid, name):
+        raw = self.client.hget(self.prefix + sid, name)
+        return json.loads(raw) if raw else {}
+
+    def save(self, sid, name, state):
+        key = self.prefix + sid
+        pipe = self.client.pipeline()
+        pipe.hset(key, name, json.dumps(state))
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def clear(self, sid):
+        self.client.delete(self.prefix + sid)
+
+    def stats(self):
+        return {"backend": "redis", "ttl": self.ttl}
+
+
+def make_store(url=SESSION_STORE_URL, ttl=SESSION_TTL):
+    """
+    The store for 'url': Redis for redis:// URLs (when the redis package is
+    installed and the server answers), otherwise in-process memory.
+    """
+    if url and url.startswith(("redis://", "rediss://", "unix://")):
+        if redis is None:
+            print("redis package not installed, keeping session state in memory.")
+        else:
+            try:
+                store = RedisSessionStore(url, ttl)
+                store.client.ping()
+                return store
+            except Exception as e:
+                print("Redis session store unavailable, keeping session state in memory:", e)
+    return MemorySessionStore(ttl)
+
+
+session_store = make_store()
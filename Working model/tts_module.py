@@ -0,0 +1,295 @@
+# tts_module.py
+# Text-to-speech for chatbot replies: pyttsx3 synthesis in a pool of worker
+# processes, behind a content-addressed audio cache (hot entries in memory,
+# the rest on disk), plus pre-synthesis of replies we know will be asked for.
+
+import os
+import re
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict, deque
+import pyttsx3
+from pool_module import BoundedProcessPool, PoolBusyError, worker_resource
+
+# ---------------- SETTINGS ----------------
+TTS_RATE = 200
+TTS_VOICE = None                    # pyttsx3 voice id; None = system default
+AUDIO_SUFFIX = ".mp3"
+TTS_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tts_cache")
+TTS_CACHE_MAX_BYTES = 200 * 1024 * 1024   # on-disk budget
+TTS_MEMORY_MAX_BYTES = 32 * 1024 * 1024   # in-memory budget for hot entries
+
+TTS_WORKERS = 2          # speech engine processes; 0 = synthesise in the calling thread
+TTS_QUEUE_MAX = 16       # jobs queued or running before new ones are rejected
+TTS_TIMEOUT = 30.0       # seconds a caller waits for its audio
+# ------------------------------------------
+
+# pyttsx3 engines are not thread-safe; in-process synthesis runs one at a time
+_engine_lock = threading.Lock()
+
+
+def _render(engine, text, rate, voice):
+    # every call writes to its own temp file, so concurrent jobs never share output
+    fd, path = tempfile.mkstemp(suffix=AUDIO_SUFFIX)
+    os.close(fd)
+    try:
+        engine.setProperty('rate', rate)
+        if voice:
+            engine.setProperty('voice', voice)
+        engine.save_to_file(text, path)
+        engine.runAndWait()
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def synthesize(text, rate=TTS_RATE, voice=TTS_VOICE):
+    """
+    Run the speech engine on 'text' in this process and return the audio bytes.
+    """
+    with _engine_lock:
+        return _render(pyttsx3.init(), text, rate, voice)
+
+
+def _worker_synthesize(text, rate, voice):
+    return _render(worker_resource(pyttsx3.init), text, rate, voice)
+
+
+class TTSBusyError(PoolBusyError):
+    pass
+
+
+class TTSWorkerPool(BoundedProcessPool):
+    """
+    Worker processes each keeping one speech engine alive for its whole life
+    (pyttsx3 is not thread-safe, so parallelism comes from processes).
+    Identical concurrent requests share one job.
+    """
+
+    def __init__(self, workers=TTS_WORKERS, max_queue=TTS_QUEUE_MAX, timeout=TTS_TIMEOUT):
+        super().__init__(workers, max_queue, timeout, initializer=worker_resource,
+                         initargs=(pyttsx3.init,), busy_error=TTSBusyError)
+
+    def submit(self, text, rate=TTS_RATE, voice=TTS_VOICE):
+        """
+        Queue a synthesis job and return its Future. Raises TTSBusyError when
+        the queue is full.
+        """
+        return self.submit_job(_worker_synthesize, text, rate, voice, key=audio_key(text, rate, voice))
+
+    def synthesize(self, text, rate=TTS_RATE, voice=TTS_VOICE, timeout=None):
+        """
+        Audio bytes for 'text' from a worker process. Raises TTSBusyError if the
+        queue is full and TimeoutError if the job takes longer than the timeout.
+        """
+        return self.wait(self.submit(text, rate, voice), timeout)
+
+
+def audio_key(text, rate=TTS_RATE, voice=TTS_VOICE):
+    return hashlib.sha256(f"{voice}|{rate}|{text}".encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    """
+    Content-addressed audio store. Entries live on disk under cache_dir
+    (evicting least recently used files beyond max_bytes); recently served
+    entries are also kept in memory up to memory_max_bytes.
+    """
+
+    def __init__(self, cache_dir=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_BYTES,
+                 memory_max_bytes=TTS_MEMORY_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory_max_bytes = memory_max_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> bytes
+        self._memory_bytes = 0
+        self._disk_bytes = None  # computed lazily from the directory
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + AUDIO_SUFFIX)
+
+    def _remember(self, key, data):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.memory_max_bytes and len(self._memory) > 1:
+            _, old = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old)
+
+    def get(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return data
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # mark as recently used for eviction
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self._remember(key, data)
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        tmp_file = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_file, "wb") as f:
+            f.write(data)
+        os.replace(tmp_file, path)
+        with self._lock:
+            self._remember(key, data)
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan()[1]
+            else:
+                self._disk_bytes += len(data)
+            if self._disk_bytes > self.max_bytes:
+                self._evict()
+
+    def _scan(self):
+        files = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(AUDIO_SUFFIX):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, name))
+            total += st.st_size
+        return files, total
+
+    def _evict(self):
+        files, total = self._scan()
+        for _, size, name in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            total -= size
+            key = name[:-len(AUDIO_SUFFIX)]
+            if key in self._memory:
+                self._memory_bytes -= len(self._memory.pop(key))
+        self._disk_bytes = total
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,
+            }
+
+
+audio_cache = AudioCache()
+tts_pool = TTSWorkerPool()
+
+
+def get_audio(text, rate=TTS_RATE, voice=TTS_VOICE):
+    """
+    Audio bytes for 'text', served from the cache or synthesised (in the worker
+    pool, or in-process when TTS_WORKERS is 0) and cached.
+    May raise TTSBusyError or TimeoutError when the pool is saturated.
+    """
+    key = audio_key(text, rate, voice)
+    data = audio_cache.get(key)
+    if data is None:
+        if tts_pool.workers > 0:
+            data = tts_pool.synthesize(text, rate, voice)
+        else:
+            data = synthesize(text, rate, voice)
+        audio_cache.put(key, data)
+    return data
+
+
+def split_sentences(text):
+    """
+    Split a reply into sentences (on . ! ? and line breaks), keeping the punctuation.
+    """
+    parts = re.split(r"(?<=[.!?])\s+|\n+", text.strip())
+    return [p.strip() for p in parts if p.strip()]
+
+
+def stream_audio(text, rate=TTS_RATE, voice=TTS_VOICE):
+    """
+    Yield one audio clip per sentence of 'text', in order. While a sentence is
+    being yielded the next ones are already synthesising in the worker pool, so
+    playback of the first sentence can start before the rest is ready.
+    May raise TTSBusyError or TimeoutError part-way through.
+    """
+    sentences = iter(split_sentences(text))
+    pending = deque()
+
+    def start(sentence):
+        key = audio_key(sentence, rate, voice)
+        data = audio_cache.get(key)
+        if data is not None or tts_pool.workers == 0:
+            return data
+        try:
+            return tts_pool.submit(sentence, rate, voice)
+        except TTSBusyError:
+            return None  # retried through get_audio when its turn comes
+
+    for _ in range(max(1, tts_pool.workers)):
+        sentence = next(sentences, None)
+        if sentence is None:
+            break
+        pending.append((sentence, start(sentence)))
+
+    while pending:
+        sentence, job = pending.popleft()
+        following = next(sentences, None)
+        if following is not None:
+            pending.append((following, start(following)))
+        if isinstance(job, bytes):
+            yield job
+        elif job is None:
+            yield get_audio(sentence, rate, voice)
+        else:
+            data = job.result(tts_pool.timeout)
+            audio_cache.put(audio_key(sentence, rate, voice), data)
+            yield data
+
+
+def presynthesize(texts):
+    """
+    Synthesise 'texts' into the cache on a background thread (skipping ones
+    already cached), so the first request for them is served from the cache.
+    """
+    def run():
+        started = time.time()
+        for text in texts:
+            if not text:
+                continue
+            try:
+                get_audio(text)
+            except Exception as e:
+                print("TTS pre-synthesis error:", e)
+        print(f"TTS pre-synthesis done ({len(texts)} replies, {time.time() - started:.1f}s)")
+
+    thread = threading.Thread(target=run, name="tts-presynthesis", daemon=True)
+    thread.start()
+    return thread